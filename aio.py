@@ -0,0 +1,294 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from threading import Condition, Lock, local
+from time import monotonic, sleep
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+
+# requests in flight; the client's connection pool is sized from it, see auth.py
+DEFAULT_LIMIT = int(getenv("aio_limit", 256))
+THROTTLE_CODES = ("SlowDown", "503", "RequestLimitExceeded", "Throttling", "ThrottlingException")
+# adaptive scheduler: requests in flight to start with and never to go under
+ADAPTIVE_START = int(getenv("adaptive_start", 8))
+ADAPTIVE_MIN = int(getenv("adaptive_min", 1))
+# latency above this multiple of the best seen stops the growth, queues are building up
+LATENCY_FACTOR = float(getenv("adaptive_latency_factor", 3))
+# requests per second a throttled prefix's limit grows by every second
+RATE_STEP = float(getenv("adaptive_rate_step", 100))
+# folders of the key rates are tracked for, S3 scales per prefix
+RATE_DEPTH = int(getenv("adaptive_prefix_depth", 1))
+
+
+class RateLimiter:
+    # token bucket shared by all worker threads, `rate` calls per second
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            sleep(delay)
+
+
+def is_throttled(error) -> bool:
+    return isinstance(error, ClientError) and error.response["Error"]["Code"] in THROTTLE_CODES
+
+
+def is_transient(error) -> bool:
+    # botocore already retried each request; these failed the whole operation
+    return is_throttled(error) or isinstance(error, (ConnectionError, HTTPClientError))
+
+
+def rate_key(bucket_name, key="", depth=RATE_DEPTH) -> str:
+    # "bucket/first/folders/" a request counts towards
+    folders = key.split("/")[:-1][:depth]
+    return "/".join([bucket_name, *folders]) + "/"
+
+
+class PrefixRate:
+    # requests per second sent to one prefix, and the pace once S3 throttled it
+    def __init__(self):
+        self.requests = 0
+        self.throttles = 0
+        self.rate = 0.0
+        self.limit = None
+        self.window_started = monotonic()
+        self.window_requests = 0
+        self.next_at = 0.0
+        self.decreased_at = 0.0
+
+    def reserve(self, now) -> float:
+        # seconds to wait before the request may go
+        self.requests += 1
+        self.window_requests += 1
+        if now - self.window_started >= 1:
+            self.rate = self.window_requests / (now - self.window_started)
+            self.window_started, self.window_requests = now, 0
+        if self.limit is None:
+            return 0.0
+        at = max(now, self.next_at)
+        self.next_at = at + 1 / self.limit
+        return at - now
+
+    def succeeded(self):
+        if self.limit is not None:
+            # additive: RATE_STEP more per second at the current pace
+            self.limit += RATE_STEP / self.limit
+
+    def throttled(self):
+        self.throttles += 1
+        now = monotonic()
+        # one cut a second, the requests already sent at the old pace report it too
+        if now - self.decreased_at < 1:
+            return
+        self.decreased_at = now
+        if self.limit is None:
+            # the pace so far, the current window counts when it is the only one
+            elapsed = now - self.window_started
+            self.limit = self.rate or (self.window_requests / elapsed if elapsed > 0 else ADAPTIVE_START)
+        self.limit = max(1.0, self.limit / 2)
+
+
+class AdaptiveScheduler:
+    # AIMD on the requests in flight, shared by every bulk path: the window grows
+    # while calls succeed at a steady latency (doubling per window until the first
+    # throttle, then by one) and halves on a throttle, once per window. Throttled
+    # prefixes are also paced on their own, the rest of the bucket keeps going
+    def __init__(self, maximum=DEFAULT_LIMIT, start=ADAPTIVE_START, minimum=ADAPTIVE_MIN, attempts=8,
+                 base_delay=0.2, max_delay=20):
+        self.maximum = maximum
+        self.minimum = max(1, minimum)
+        self.limit = float(max(self.minimum, min(start, maximum)))
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.condition = Condition()
+        self.in_flight = 0
+        self.slow_start = True
+        self.completed = 0
+        self.decreased_at = None
+        self.throttles = 0
+        self.latency = {}
+        self.prefixes = {}
+        # set by watch_throttles when botocore's own attempts were throttled
+        self.attempts_throttled = local()
+
+    def acquire(self, prefix):
+        # the prefix's pace first, a slot held while sleeping would hold up the other prefixes
+        with self.condition:
+            delay = self.prefixes.setdefault(prefix, PrefixRate()).reserve(monotonic())
+        if delay:
+            sleep(delay)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def _decrease(self, factor):
+        # the calls in flight when the window was too big all report it, one cut is enough
+        if self.decreased_at is not None and self.completed - self.decreased_at < self.limit:
+            return
+        self.decreased_at = self.completed
+        self.slow_start = False
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def throttled(self, prefix):
+        # also for throttles that come back inside a response, e.g. DeleteObjects' Errors
+        with self.condition:
+            self.throttles += 1
+            self.prefixes.setdefault(prefix, PrefixRate()).throttled()
+            self._decrease(0.5)
+
+    def backoff(self, attempt):
+        # full jitter, https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def release(self, prefix, operation, latency, throttled, failed=False):
+        # latency None: the call's time says nothing about the load, see transfer;
+        # a failed call frees its slot and is no sign the window or the pace can grow
+        if throttled:
+            self.throttled(prefix)
+        with self.condition:
+            self.in_flight -= 1
+            self.completed += 1
+            if not (throttled or failed):
+                self.prefixes[prefix].succeeded()
+                slower = False
+                if latency is not None:
+                    # smoothed latency against the best smoothed one, per operation; the best
+                    # drifts up slowly so a lasting change (bigger parts, another region) is learnt
+                    average, best = self.latency.get(operation, (latency, latency))
+                    average = 0.8 * average + 0.2 * latency
+                    best = min(average, best * 1.001)
+                    self.latency[operation] = (average, best)
+                    slower = average > LATENCY_FACTOR * best
+                if slower:
+                    self._decrease(0.9)
+                else:
+                    self.limit = min(self.maximum, self.limit + (1 if self.slow_start else 1 / self.limit))
+            self.condition.notify_all()
+
+    def call(self, prefix, func, *args, **kwargs):
+        # func(*args, **kwargs) once there is room; throttled and connection errors
+        # are retried with full-jitter backoff outside the window, others raise at once
+        for attempt in range(self.attempts):
+            self.acquire(prefix)
+            started, throttled, failed = monotonic(), False, False
+            self.attempts_throttled.seen = False
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                # a dropped connection is as much a sign of overload as a SlowDown;
+                # already counted when the client reported its attempts
+                throttled, failed = is_transient(error) and not self.attempts_throttled.seen, True
+                if not is_transient(error) or attempt == self.attempts - 1:
+                    raise
+            finally:
+                self.release(prefix, getattr(func, "__name__", ""), monotonic() - started, throttled, failed)
+            self.backoff(attempt)
+
+    def transfer(self, prefix, func, *args, **kwargs):
+        # a whole upload_file/download_file: its time grows with the file and boto3
+        # retries each of its requests, so it is sent once and its latency isn't learnt
+        self.acquire(prefix)
+        throttled, failed = False, False
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            throttled, failed = is_transient(error), True
+            raise
+        finally:
+            self.release(prefix, getattr(func, "__name__", ""), None, throttled, failed)
+
+    def summary(self) -> dict:
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "throttles": self.throttles,
+                "prefixes": {prefix: {"requests": each.requests, "throttles": each.throttles, "rate": each.rate,
+                                      "limit": each.limit}
+                             for prefix, each in self.prefixes.items()}
+            }
+
+
+SCHEDULER = AdaptiveScheduler()
+
+
+def watch_throttles(client, scheduler=SCHEDULER):
+    # botocore retries a SlowDown up to aws_max_attempts times before the call
+    # fails, every throttled attempt is reported to the scheduler as it happens
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/events.html
+    def provide_client_params(params, context, **kwargs):
+        if "Bucket" in params:
+            context["rate_key"] = rate_key(params["Bucket"], params.get("Key", ""))
+
+    def needs_retry(response, caught_exception, request_dict, **kwargs):
+        code = response[1].get("Error", {}).get("Code") if response else None
+        prefix = request_dict.get("context", {}).get("rate_key")
+        if prefix and (code in THROTTLE_CODES or isinstance(caught_exception, (ConnectionError, HTTPClientError))):
+            scheduler.throttled(prefix)
+            scheduler.attempts_throttled.seen = True
+
+    client.meta.events.register("provide-client-params.s3", provide_client_params)
+    client.meta.events.register("needs-retry.s3", needs_retry)
+    return client
+
+
+async def map_bounded(func, items, limit=DEFAULT_LIMIT, on_result=None) -> dict:
+    # runs func(item) for every item with at most `limit` calls in flight.
+    # boto3 is blocking, so each call runs on an executor thread and the event
+    # loop only schedules; items are pulled lazily, a huge iterator is fine.
+    # on_result(item, result, error) is called on the loop thread as calls finish
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(limit)
+    summary = {"succeeded": 0, "failed": 0}
+    tasks = set()
+
+    async def call(item):
+        try:
+            result, error = await loop.run_in_executor(executor, func, item), None
+        except Exception as exception:
+            result, error = None, exception
+        finally:
+            semaphore.release()
+        summary["failed" if error else "succeeded"] += 1
+        if on_result:
+            on_result(item, result, error)
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        for item in items:
+            await semaphore.acquire()
+            task = asyncio.ensure_future(call(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    return summary
+
+
+def run_bounded(func, items, limit=DEFAULT_LIMIT, on_result=None) -> dict:
+    return asyncio.run(map_bounded(func, items, limit, on_result))
+
+
+def results_of(func, items, limit=DEFAULT_LIMIT) -> dict:
+    # {item: result}, failed calls map to their exception
+    results = {}
+
+    def collect(item, result, error):
+        results[item] = error or result
+
+    run_bounded(func, items, limit, collect)
+    return results
@@ -1,24 +1,59 @@
 import boto3
+from botocore.config import Config
+from functools import lru_cache
 from os import getenv
 from dotenv import load_dotenv
+from aio import DEFAULT_LIMIT, watch_throttles
+from metrics import instrument
 
 
 load_dotenv()
 
 
-def init_client():
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def client_config(max_pool_connections=None, connect_timeout=None, read_timeout=None,
+                  retry_mode=None, max_attempts=None, tcp_keepalive=None, workers=0) -> Config:
+    # https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+    return Config(
+        # every call in flight needs a connection, botocore's default is 10; as many
+        # as the asyncio layer sends at once, or the workers when there are more
+        max_pool_connections=max(max_pool_connections or int(getenv("aws_max_pool_connections", DEFAULT_LIMIT)),
+                                 workers),
+        connect_timeout=connect_timeout or float(getenv("aws_connect_timeout", 10)),
+        read_timeout=read_timeout or float(getenv("aws_read_timeout", 60)),
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
+        retries={
+            "mode": retry_mode or getenv("aws_retry_mode", "adaptive"),
+            "max_attempts": max_attempts or int(getenv("aws_max_attempts", 10))
+        },
+        tcp_keepalive=_flag(getenv("aws_tcp_keepalive", "True")) if tcp_keepalive is None else tcp_keepalive
+    )
+
+
+@lru_cache
+def check_credentials(client):
+    # one list_buckets per client, and only when asked for
+    client.list_buckets()
+    return True
+
+
+def init_client(endpoint_url=None, check=None, region_name=None, **config):
     client = boto3.client("s3",
                           aws_access_key_id=getenv("aws_access_key_id"),
                           aws_secret_access_key=getenv("aws_secret_access_key"),
                           aws_session_token=getenv("aws_session_token"),
-                          region_name=getenv("aws_region_name")
-                          #  config=botocore.client.Config(
-                          #      connect_timeout=conf.remote_cfg["remote_timeout"],
-                          #      read_timeout=conf.remote_cfg["remote_timeout"],
-                          #      retries={
-                          #          "max_attempts": conf.remote_cfg["remote_retries"]}
+                          region_name=region_name or getenv("aws_region_name"),
+                          # e.g. a local S3 stand-in
+                          endpoint_url=endpoint_url or getenv("aws_endpoint_url"),
+                          config=client_config(**config)
                           )
-    # check if credentials are correct
-    client.list_buckets()
+    # bad credentials fail the first real call anyway, checking up front is optional
+    if _flag(getenv("aws_check_credentials", "False")) if check is None else check:
+        check_credentials(client)
 
-    return client
+    # request counts, retries, latency and bytes of every call, see metrics.py;
+    # throttled attempts feed the adaptive scheduler, see aio.py
+    return watch_throttles(instrument(client))
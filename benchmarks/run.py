@@ -0,0 +1,300 @@
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timezone
+from math import ceil
+from pathlib import Path
+from threading import Event, Thread
+from time import perf_counter
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import sys
+import tempfile
+
+# run from the repository root: python -m benchmarks.run
+from auth import init_client
+from bucket.listing import iter_keys, LIST_SHARDS
+from bucket.organize import object_per_extension
+from metrics import METRICS
+from object.crud import upload_local_file
+from object.multipart import DEFAULT_CONCURRENCY
+from object.versioning import delete_old_files
+
+
+UPLOAD_TYPES = ("upload_file", "upload_fileobj", "put_object", "multipart_upload")
+SCENARIOS = ("upload", "list", "versions", "organize")
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/upload-objects.html
+MAX_PUT_BYTES = 5 * 1024 ** 3
+
+
+def parse_size(text) -> int:
+    text = text.strip().upper().rstrip("B")
+    if text[-1:] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def synthetic_file(path, size, chunk_bytes=1024 * 1024):
+    # random base64 lines: incompressible, and libmagic sees text/plain so
+    # the allow-list in object/content_type.py lets it through
+    with open(path, "w") as f:
+        written = 0
+        while written < size:
+            line_bytes = min(chunk_bytes, size - written)
+            raw = b64encode(os.urandom(chunk_bytes))[:max(line_bytes - 1, 0)]
+            f.write(raw.decode("ascii") + "\n")
+            written += len(raw) + 1
+    return path
+
+
+def rss() -> int:
+    # resident set size now, /proc is Linux only; ru_maxrss is the peak
+    # of the whole process and only a fallback
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (FileNotFoundError, ValueError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def peak_rss(interval=0.01):
+    result = {"peak": rss()}
+    stop = Event()
+
+    def sample():
+        while not stop.wait(interval):
+            result["peak"] = max(result["peak"], rss())
+
+    sampler = Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield result
+    finally:
+        stop.set()
+        sampler.join()
+        result["peak"] = max(result["peak"], rss())
+
+
+def percentile(values, q):
+    # nearest rank, exact for the handful of repeats a benchmark runs
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, ceil(q * len(ordered)) - 1))]
+
+
+def request_counts() -> dict:
+    return {name: (each["requests"], each["retries"], sum(each["errors"].values()), each["latency_sum"])
+            for name, each in METRICS.summary()["operations"].items()}
+
+
+def _add_requests(requests, before, after):
+    for name, (count, retries, errors, latency) in after.items():
+        old = before.get(name, (0, 0, 0, 0.0))
+        if count - old[0]:
+            each = requests.setdefault(name, {"count": 0, "retries": 0, "errors": 0, "latency_sum": 0.0})
+            each["count"] += count - old[0]
+            each["retries"] += retries - old[1]
+            each["errors"] += errors - old[2]
+            each["latency_sum"] += latency - old[3]
+
+
+def measure(name, func, repeats, payload_bytes=0, items=0, setup=None) -> dict:
+    seconds, peaks, requests = [], [], {}
+    for repeat in range(repeats):
+        # setup (fresh files, buckets, versions) is neither timed nor counted
+        argument = setup(repeat) if setup else None
+        baseline, before = rss(), request_counts()
+        with peak_rss() as memory:
+            started = perf_counter()
+            func(argument)
+            seconds.append(perf_counter() - started)
+        peaks.append(memory["peak"] - baseline)
+        _add_requests(requests, before, request_counts())
+
+    for each in requests.values():
+        each["per_run"] = each["count"] / repeats
+        each["latency_avg"] = each.pop("latency_sum") / each["count"]
+
+    result = {
+        "name": name,
+        "repeats": repeats,
+        "seconds": {"min": min(seconds), "p50": percentile(seconds, 0.5), "p90": percentile(seconds, 0.9),
+                    "p99": percentile(seconds, 0.99), "max": max(seconds), "mean": sum(seconds) / len(seconds)},
+        "peak_rss_mb": max(peaks) / 1024 / 1024,
+        "requests": requests
+    }
+    if payload_bytes:
+        result["bytes"] = payload_bytes
+        result["throughput_mb_s"] = payload_bytes / result["seconds"]["p50"] / 1024 / 1024
+    if items:
+        result["items"] = items
+        result["items_per_s"] = items / result["seconds"]["p50"]
+    print("{0}: p50 {1:.3f}s{2}{3}, peak RSS +{4:.1f} MiB".format(
+        name, result["seconds"]["p50"],
+        ", {0:.1f} MB/s".format(result["throughput_mb_s"]) if payload_bytes else "",
+        ", {0:.0f}/s".format(result["items_per_s"]) if items else "",
+        result["peak_rss_mb"]), file=sys.stderr)
+    return result
+
+
+def populate(aws_s3_client, bucket_name, keys, body=b"x" * 1024, concurrency=DEFAULT_CONCURRENCY):
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(lambda key: aws_s3_client.put_object(Bucket=bucket_name, Key=key, Body=body), keys))
+
+
+def bench_uploads(aws_s3_client, sizes, repeats, concurrency) -> list:
+    aws_s3_client.create_bucket(Bucket="bench-upload")
+    Path("static").mkdir(exist_ok=True)
+    results = []
+    for size in sizes:
+        file_name = f"bench_{size}.txt"
+        synthetic_file(Path("static") / file_name, size)
+        for upload_type in UPLOAD_TYPES:
+            if upload_type == "put_object" and size > MAX_PUT_BYTES:
+                continue
+            results.append(measure(
+                f"upload/{upload_type}/{size}",
+                lambda _, upload_type=upload_type: upload_local_file(
+                    aws_s3_client, "bench-upload", file_name, True, upload_type, concurrency=concurrency),
+                repeats, payload_bytes=size))
+        (Path("static") / file_name).unlink()
+    return results
+
+
+def bench_listing(aws_s3_client, objects, repeats, concurrency) -> list:
+    aws_s3_client.create_bucket(Bucket="bench-list")
+    populate(aws_s3_client, "bench-list", [f"{i % 64:02x}/{i:08d}.txt" for i in range(objects)],
+             concurrency=concurrency)
+    return [
+        measure(f"list/shards_{shards}",
+                lambda _, shards=shards: sum(1 for _ in iter_keys(aws_s3_client, "bench-list", shards=shards,
+                                                                  concurrency=concurrency)),
+                repeats, items=objects)
+        for shards in sorted({1, LIST_SHARDS})
+    ]
+
+
+def bench_versions(aws_s3_client, objects, versions, repeats, concurrency) -> list:
+    def setup(repeat):
+        bucket_name = f"bench-versions-{repeat}"
+        aws_s3_client.create_bucket(Bucket=bucket_name)
+        aws_s3_client.put_bucket_versioning(Bucket=bucket_name, VersioningConfiguration={"Status": "Enabled"})
+        keys = [f"{i:08d}.txt" for i in range(objects)]
+        for _ in range(versions):
+            populate(aws_s3_client, bucket_name, keys, concurrency=concurrency)
+        return bucket_name
+
+    return [measure(
+        "versions/delete_noncurrent",
+        lambda bucket_name: delete_old_files(aws_s3_client, bucket_name, "", older_than_days=0, noncurrent_only=True,
+                                             concurrency=concurrency),
+        repeats, items=objects * (versions - 1), setup=setup)]
+
+
+def bench_organize(aws_s3_client, objects, repeats, concurrency) -> list:
+    extensions = ("txt", "jpeg", "png", "mp4")
+
+    def setup(repeat):
+        bucket_name = f"bench-organize-{repeat}"
+        aws_s3_client.create_bucket(Bucket=bucket_name)
+        populate(aws_s3_client, bucket_name, [f"{i:08d}.{extensions[i % len(extensions)]}" for i in range(objects)],
+                 concurrency=concurrency)
+        return bucket_name
+
+    return [measure(
+        "organize/object_per_extension",
+        lambda bucket_name: object_per_extension(aws_s3_client, bucket_name, concurrency=concurrency, resume=False),
+        repeats, items=objects, setup=setup)]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stand_in(stack, backend, endpoint_url):
+    # an external endpoint (MinIO, moto_server, ...) is used as is; the moto
+    # backends get throwaway credentials so nothing from .env is sent anywhere
+    if backend == "endpoint":
+        return endpoint_url
+    os.environ.update(aws_access_key_id="benchmark", aws_secret_access_key="benchmark", aws_region_name="us-east-1")
+    os.environ.pop("aws_session_token", None)
+    if backend == "mock":
+        from moto import mock_aws
+        stack.enter_context(mock_aws())
+        return None
+
+    # real HTTP on localhost, closer to a remote S3 than the in-process mock
+    from moto.server import ThreadedMotoServer
+    # one access log line per request would drown the results
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    stack.callback(server.stop)
+    return f"http://127.0.0.1:{port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the upload modes, listing, versions cleanup and "
+                                                 "organize against a local S3 stand-in.")
+    parser.add_argument("--backend", choices=["server", "mock", "endpoint"], default="server",
+                        help="moto over HTTP, moto in-process, or --endpoint_url")
+    parser.add_argument("--endpoint_url", type=str, default=None, help="S3 endpoint for --backend endpoint")
+    parser.add_argument("--only", type=str, default=",".join(SCENARIOS), help="comma separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--sizes", type=str, default="4K,1M,16M,64M", help="upload file sizes, e.g. 4K,1M,1G")
+    parser.add_argument("--objects", type=int, default=2000, help="objects for listing and organize")
+    parser.add_argument("--versioned_objects", type=int, default=200, help="keys for the versions cleanup")
+    parser.add_argument("--versions", type=int, default=4, help="versions per key for the versions cleanup")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--output", type=str, default="-", help="JSON results file, '-' for stdout")
+    args = parser.parse_args(argv)
+    if args.backend == "endpoint" and not args.endpoint_url:
+        parser.error("--backend endpoint needs --endpoint_url")
+
+    only = {each.strip() for each in args.only.split(",")}
+    output = args.output if args.output == "-" else os.path.abspath(args.output)
+    report = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "concurrency": args.concurrency,
+        "results": []
+    }
+
+    with ExitStack() as stack:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="s3_bench_"))
+        client = init_client(stand_in(stack, args.backend, args.endpoint_url), workers=args.concurrency)
+        # static/, the multipart journals and the organize checkpoints land here
+        stack.callback(os.chdir, os.getcwd())
+        os.chdir(workdir)
+        results = report["results"]
+        if "upload" in only:
+            results += bench_uploads(client, [parse_size(each) for each in args.sizes.split(",")],
+                                     args.repeats, args.concurrency)
+        if "list" in only:
+            results += bench_listing(client, args.objects, args.repeats, args.concurrency)
+        if "versions" in only:
+            results += bench_versions(client, args.versioned_objects, args.versions, args.repeats, args.concurrency)
+        if "organize" in only:
+            results += bench_organize(client, args.objects, args.repeats, args.concurrency)
+
+    report["totals"] = METRICS.summary()
+    if output == "-":
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from botocore.exceptions import ClientError
+from aio import DEFAULT_LIMIT, results_of
 
 
 def list_buckets(aws_s3_client) -> list:
@@ -8,11 +9,13 @@ def list_buckets(aws_s3_client) -> list:
 
 
 def create_bucket(aws_s3_client, bucket_name, region) -> bool:
-    location = {'LocationConstraint': region}
+    # us-east-1 is the default and must not be passed as a LocationConstraint
+    location = {'CreateBucketConfiguration': {'LocationConstraint': region}} \
+        if region and region != "us-east-1" else {}
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/create_bucket.html
     response = aws_s3_client.create_bucket(
         Bucket=bucket_name,
-        CreateBucketConfiguration=location
+        **location
     )
     status_code = response["ResponseMetadata"]["HTTPStatusCode"]
     if status_code == 200:
@@ -38,3 +41,8 @@ def bucket_exists(aws_s3_client, bucket_name) -> bool:
     except ClientError:
         # print(e)
         return False
+
+
+def buckets_exist(aws_s3_client, bucket_names, limit=DEFAULT_LIMIT) -> dict:
+    # {bucket_name: bool}, all HEAD requests in flight at once
+    return results_of(lambda bucket_name: bool(bucket_exists(aws_s3_client, bucket_name)), bucket_names, limit)
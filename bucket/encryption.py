@@ -1,9 +1,12 @@
-def set_bucket_encryption(aws_s3_client, bucket_name):
+def set_bucket_encryption(aws_s3_client, bucket_name, algorithm="AES256", kms_key_id=None):
+    default = {"SSEAlgorithm": algorithm}
+    if kms_key_id:
+        default["KMSMasterKeyID"] = kms_key_id
     response = aws_s3_client.put_bucket_encryption(
         Bucket=bucket_name,
         ServerSideEncryptionConfiguration={
             "Rules": [
-                {"ApplyServerSideEncryptionByDefault": {"SSEAlgorithm": "AES256"}}
+                {"ApplyServerSideEncryptionByDefault": default}
             ]
         },
     )
@@ -0,0 +1,178 @@
+from datetime import datetime, timezone
+from itertools import groupby
+from os import getenv
+from pathlib import Path
+import sqlite3
+from bucket.listing import iter_keys
+from object.batch import batches
+from object.multipart import DEFAULT_CONCURRENCY
+
+
+INDEX_PATH = Path(getenv("bucket_index_path", ".index/s3_index.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT NOT NULL,
+    storage_class TEXT,
+    PRIMARY KEY (bucket, key)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version_id TEXT NOT NULL,
+    is_latest INTEGER NOT NULL,
+    is_delete_marker INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT NOT NULL,
+    PRIMARY KEY (bucket, key, version_id)
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    bucket TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    refreshed_at TEXT NOT NULL,
+    PRIMARY KEY (bucket, kind, prefix)
+);
+"""
+
+
+def connect(path=INDEX_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _object_row(bucket_name, each) -> tuple:
+    return (bucket_name, each["Key"], each["Size"], each.get("ETag"),
+            each["LastModified"].isoformat(), each.get("StorageClass"))
+
+
+def _version_row(bucket_name, each) -> tuple:
+    return (bucket_name, each["Key"], each["VersionId"], int(each["IsLatest"]),
+            int(each.get("IsDeleteMarker", False)), each["Size"], each.get("ETag"),
+            each["LastModified"].isoformat())
+
+
+# keys diffed against the index per transaction
+REFRESH_BATCH_KEYS = 1000
+
+
+def _key_groups(entries):
+    # (key, [entries of the key]); the listing comes in key order, a key's versions are adjacent
+    for key, group in groupby(entries, key=lambda entry: entry["Key"]):
+        yield key, list(group)
+
+
+def _refresh_range(connection, bucket_name, prefix, after, last, groups, versions) -> tuple:
+    # the listing's keys in (after, last] against the index rows of the same range:
+    # only changed rows are written, rows S3 no longer has are deleted
+    table, row, columns = ("versions", _version_row, ("key", "version_id")) if versions \
+        else ("objects", _object_row, ("key",))
+    upper = "key <= ?" if last is not None else "key < ?"
+    existing = {tuple(stored[column] for column in columns): tuple(stored)
+                for stored in connection.execute(
+                    f"SELECT * FROM {table} WHERE bucket = ? AND key >= ? AND key > ? AND {upper}",
+                    (bucket_name, prefix, after, prefix + "\U0010ffff" if last is None else last))}
+
+    changed = []
+    for _, entries in groups:
+        for each in entries:
+            fresh = row(bucket_name, each)
+            identity = tuple(fresh[1:1 + len(columns)])
+            if existing.pop(identity, None) != fresh:
+                changed.append(fresh)
+
+    connection.executemany(
+        f"DELETE FROM {table} WHERE bucket = ? AND " + " AND ".join(f"{column} = ?" for column in columns),
+        [(bucket_name, *identity) for identity in existing])
+    if changed:
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(changed[0]))})", changed)
+    return len(changed), len(existing)
+
+
+def refresh_index(aws_s3_client, bucket_name, prefix="", versions=False, concurrency=DEFAULT_CONCURRENCY,
+                  connection=None) -> dict:
+    # one pass over the whole prefix: the listing and the index are both in key
+    # order, so every stored row falls in the range of some batch and keys gone
+    # from S3, whole folders included, are found
+    connection = connection or connect()
+    report = {"changed": 0, "removed": 0}
+    after = ""
+    entries = iter_keys(aws_s3_client, bucket_name, prefix, versions, concurrency=concurrency)
+    for groups in batches(_key_groups(entries), REFRESH_BATCH_KEYS):
+        # every batch is its own transaction, a failed refresh keeps the finished ones
+        with connection:
+            changed, removed = _refresh_range(connection, bucket_name, prefix, after, groups[-1][0], groups,
+                                              versions)
+        report["changed"] += changed
+        report["removed"] += removed
+        after = groups[-1][0]
+
+    with connection:
+        # whatever sorts after the last listed key is gone
+        changed, removed = _refresh_range(connection, bucket_name, prefix, after, None, [], versions)
+        report["removed"] += removed
+        connection.execute(
+            "INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?)",
+            (bucket_name, "versions" if versions else "objects", prefix, datetime.now(timezone.utc).isoformat()))
+    print("Index of {0} refreshed: {1} changed, {2} removed".format(bucket_name, report["changed"], report["removed"]))
+    return report
+
+
+def is_indexed(bucket_name, prefix="", versions=False, connection=None) -> bool:
+    # a refresh of a parent prefix covers this one too
+    connection = connection or connect()
+    for refresh in connection.execute(
+            "SELECT prefix FROM refreshes WHERE bucket = ? AND kind = ?",
+            (bucket_name, "versions" if versions else "objects")):
+        if prefix.startswith(refresh["prefix"]):
+            return True
+    return False
+
+
+def _from_row(row) -> dict:
+    entry = {"Key": row["key"], "Size": row["size"], "ETag": row["etag"],
+             "LastModified": datetime.fromisoformat(row["last_modified"])}
+    if "version_id" in row.keys():
+        entry.update(VersionId=row["version_id"], IsLatest=bool(row["is_latest"]))
+        if row["is_delete_marker"]:
+            entry["IsDeleteMarker"] = True
+    else:
+        entry["StorageClass"] = row["storage_class"]
+    return entry
+
+
+def indexed_pages(bucket_name, prefix="", versions=False, start_after="", page_size=1000, connection=None):
+    # same page shape as the list_objects_v2 / list_object_versions paginators
+    connection = connection or connect()
+    table, order = ("versions", "key, last_modified DESC") if versions else ("objects", "key")
+    cursor = connection.execute(
+        f"SELECT * FROM {table} WHERE bucket = ? AND key >= ? AND key < ? AND key > ? ORDER BY {order}",
+        (bucket_name, prefix, prefix + "\U0010ffff", start_after))
+    while rows := cursor.fetchmany(page_size):
+        entries = [_from_row(row) for row in rows]
+        if not versions:
+            yield {"Contents": entries}
+            continue
+        yield {"Versions": [entry for entry in entries if not entry.get("IsDeleteMarker")],
+               "DeleteMarkers": [entry for entry in entries if entry.get("IsDeleteMarker")]}
+
+
+def indexed_entries(aws_s3_client, bucket_name, prefix="", versions=False, concurrency=DEFAULT_CONCURRENCY,
+                    connection=None):
+    # fills the index on first use, later calls don't touch S3
+    connection = connection or connect()
+    if not is_indexed(bucket_name, prefix, versions, connection):
+        refresh_index(aws_s3_client, bucket_name, prefix, versions, concurrency, connection)
+    for page in indexed_pages(bucket_name, prefix, versions, connection=connection):
+        yield from page.get("Contents", [])
+        yield from page.get("Versions", [])
+        yield from page.get("DeleteMarkers", [])
@@ -0,0 +1,164 @@
+from datetime import datetime, timezone
+from pathlib import Path
+import csv
+import json
+import numpy as np
+from bucket.index import indexed_entries
+from bucket.listing import iter_keys
+from bucket.organize import extension_folder
+from object.batch import batches
+from object.multipart import DEFAULT_CONCURRENCY
+
+
+# entries turned into arrays at a time, bounds the per-key Python objects alive
+CHUNK_ENTRIES = 1_000_000
+# upper bounds in days
+AGE_BUCKETS = (7, 30, 90, 365)
+AGE_LABELS = ("<7d", "7-30d", "30-90d", "90-365d", ">365d")
+BREAKDOWNS = ("prefix", "extension", "storage_class", "age")
+
+
+def _prefix(key, depth) -> str:
+    # the first `depth` folders of the key, "/" for keys at the top
+    parts = key.split("/")[:-1][:depth]
+    return "/".join(parts) + "/" if parts else "/"
+
+
+def _codes(values, table) -> np.ndarray:
+    # dictionary encoding, table maps value -> code and grows as new values show up;
+    # only the chunk's distinct values go through Python code
+    for value in dict.fromkeys(values):
+        table.setdefault(value, len(table))
+    return np.fromiter(map(table.__getitem__, values), np.int32, len(values))
+
+
+def _largest(sizes, current, keys, top) -> list:
+    # the chunk's top candidates among current objects, merged across chunks later
+    candidates = np.flatnonzero(current)
+    if len(candidates) > top:
+        candidates = candidates[np.argpartition(sizes[candidates], -top)[-top:]]
+    return [(int(sizes[i]), keys[i]) for i in candidates]
+
+
+def load_columns(entries, depth=1, top=10, now=None) -> dict:
+    # streams listing entries (versions and delete markers) into columnar arrays
+    now = (now or datetime.now(timezone.utc)).timestamp()
+    tables = {"prefix": {}, "extension": {}, "storage_class": {}}
+    columns = {name: [] for name in ("size", "age_days", "latest", "marker", *tables)}
+    largest = []
+
+    for chunk in batches(entries, CHUNK_ENTRIES):
+        keys = [entry["Key"] for entry in chunk]
+        size = np.fromiter((entry.get("Size", 0) for entry in chunk), np.int64, len(chunk))
+        marker = np.fromiter((bool(entry.get("IsDeleteMarker")) for entry in chunk), bool, len(chunk))
+        # plain listings have no IsLatest, every entry is current there
+        latest = np.fromiter((entry.get("IsLatest", True) for entry in chunk), bool, len(chunk))
+        modified = np.fromiter((entry["LastModified"].timestamp() for entry in chunk), np.float64, len(chunk))
+
+        columns["size"].append(size)
+        columns["marker"].append(marker)
+        columns["latest"].append(latest)
+        columns["age_days"].append((now - modified) / 86400)
+        columns["prefix"].append(_codes([_prefix(key, depth) for key in keys], tables["prefix"]))
+        columns["extension"].append(_codes([extension_folder(key) for key in keys], tables["extension"]))
+        columns["storage_class"].append(
+            _codes([entry.get("StorageClass") or "STANDARD" for entry in chunk], tables["storage_class"]))
+        largest += _largest(size, latest & ~marker, keys, top)
+
+    arrays = {name: np.concatenate(chunks) if chunks else np.empty(0) for name, chunks in columns.items()}
+    for name, table in tables.items():
+        arrays[name] = arrays[name].astype(np.int32)
+        arrays[name + "_names"] = list(table)
+    arrays["largest"] = sorted(largest, reverse=True)[:top]
+    return arrays
+
+
+def _breakdown(codes, names, size, current, noncurrent) -> list:
+    # one bincount per figure instead of a Python loop over the keys
+    length = len(names)
+    objects = np.bincount(codes[current], minlength=length)
+    object_bytes = np.bincount(codes[current], weights=size[current], minlength=length)
+    versions = np.bincount(codes[noncurrent], minlength=length)
+    version_bytes = np.bincount(codes[noncurrent], weights=size[noncurrent], minlength=length)
+    rows = [{"name": name, "objects": int(objects[i]), "bytes": int(object_bytes[i]),
+             "noncurrent_versions": int(versions[i]), "noncurrent_bytes": int(version_bytes[i])}
+            for i, name in enumerate(names)]
+    return sorted(rows, key=lambda row: row["bytes"] + row["noncurrent_bytes"], reverse=True)
+
+
+def analyze(arrays) -> dict:
+    size, marker, latest = arrays["size"].astype(np.int64), arrays["marker"].astype(bool), \
+        arrays["latest"].astype(bool)
+    current = latest & ~marker
+    noncurrent = ~latest & ~marker
+    arrays["age"] = np.digitize(arrays["age_days"], AGE_BUCKETS).astype(np.int32)
+    arrays["age_names"] = list(AGE_LABELS)
+
+    total_bytes = int(size[~marker].sum())
+    noncurrent_bytes = int(size[noncurrent].sum())
+    return {
+        "totals": {
+            "objects": int(current.sum()),
+            "bytes": int(size[current].sum()),
+            "noncurrent_versions": int(noncurrent.sum()),
+            "noncurrent_bytes": noncurrent_bytes,
+            "delete_markers": int(marker.sum()),
+            # share of the stored bytes only older versions hold
+            "noncurrent_overhead": noncurrent_bytes / total_bytes if total_bytes else 0.0
+        },
+        **{name: _breakdown(arrays[name], arrays[name + "_names"], size, current, noncurrent)
+           for name in BREAKDOWNS},
+        "largest": [{"key": key, "bytes": object_bytes} for object_bytes, key in arrays["largest"]]
+    }
+
+
+def inventory(aws_s3_client, bucket_name, prefix="", depth=1, top=10, use_index=False,
+              concurrency=DEFAULT_CONCURRENCY, now=None) -> dict:
+    if use_index:
+        entries = indexed_entries(aws_s3_client, bucket_name, prefix, True, concurrency)
+    else:
+        entries = iter_keys(aws_s3_client, bucket_name, prefix, versions=True, concurrency=concurrency)
+    return analyze(load_columns(entries, depth, top, now))
+
+
+def _size(value) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if value < 1024 or unit == "TiB":
+            return f"{value:.1f} {unit}" if unit != "B" else f"{value} B"
+        value /= 1024
+
+
+def print_report(report, rows=10):
+    totals = report["totals"]
+    print("{0} objects, {1}; {2} noncurrent versions, {3} ({4:.1%} overhead); {5} delete markers".format(
+        totals["objects"], _size(totals["bytes"]), totals["noncurrent_versions"], _size(totals["noncurrent_bytes"]),
+        totals["noncurrent_overhead"], totals["delete_markers"]))
+    for name in BREAKDOWNS:
+        print(f"By {name.replace('_', ' ')}:")
+        for row in report[name][:rows]:
+            print(f" {row['name']}: {row['objects']} objects, {_size(row['bytes'])}, "
+                  f"{row['noncurrent_versions']} noncurrent, {_size(row['noncurrent_bytes'])}")
+    print("Largest:")
+    for row in report["largest"]:
+        print(f" {row['key']}: {_size(row['bytes'])}")
+
+
+def write_report(report, path, report_format=None):
+    path = Path(path)
+    report_format = report_format or ("csv" if path.suffix.lower() == ".csv" else "json")
+    with open(path, "w", newline="") as f:
+        if report_format == "json":
+            json.dump(report, f, indent=2)
+            return
+        # one flat table: breakdown, name and the figures
+        writer = csv.writer(f)
+        writer.writerow(["breakdown", "name", "objects", "bytes", "noncurrent_versions", "noncurrent_bytes"])
+        totals = report["totals"]
+        writer.writerow(["totals", "", totals["objects"], totals["bytes"], totals["noncurrent_versions"],
+                         totals["noncurrent_bytes"]])
+        for name in BREAKDOWNS:
+            for row in report[name]:
+                writer.writerow([name, row["name"], row["objects"], row["bytes"], row["noncurrent_versions"],
+                                 row["noncurrent_bytes"]])
+        for row in report["largest"]:
+            writer.writerow(["largest", row["key"], 1, row["bytes"], 0, 0])
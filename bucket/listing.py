@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from queue import Queue, Full
+from threading import Event
+from object.multipart import DEFAULT_CONCURRENCY
+
+
+# keys are split on their first character after the prefix, ranges follow S3's byte order
+SHARD_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+LIST_SHARDS = int(getenv("list_shards", 16))
+# pages a shard may list ahead of the consumer
+SHARD_BUFFER_PAGES = 4
+MAX_CHAR = "\U0010ffff"
+
+
+def list_shard(aws_s3_client, bucket_name, prefix="", versions=False, delimiter=None) -> tuple:
+    # returns (entries, common prefixes), delete markers come with "IsDeleteMarker"
+    entries, prefixes = [], []
+    extra = {"Delimiter": delimiter} if delimiter else {}
+    if versions:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListObjectVersions.html
+        paginator = aws_s3_client.get_paginator("list_object_versions")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, **extra):
+            entries += page.get("Versions", [])
+            entries += [{**marker, "IsDeleteMarker": True, "Size": 0} for marker in page.get("DeleteMarkers", [])]
+            prefixes += [each["Prefix"] for each in page.get("CommonPrefixes", [])]
+        return entries, prefixes
+
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListObjectsV2.html
+    paginator = aws_s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, **extra):
+        entries += page.get("Contents", [])
+        prefixes += [each["Prefix"] for each in page.get("CommonPrefixes", [])]
+    return entries, prefixes
+
+
+def character_boundaries(prefix, shards=LIST_SHARDS) -> list:
+    # n shards -> n - 1 boundaries, the first and last shard are open ended
+    shards = max(1, min(shards, len(SHARD_ALPHABET) + 1))
+    return [prefix + SHARD_ALPHABET[i * len(SHARD_ALPHABET) // shards] for i in range(1, shards)]
+
+
+def _before(key) -> str:
+    # StartAfter / KeyMarker are exclusive, this sorts right before `key`
+    return key[:-1] + chr(ord(key[-1]) - 1) + MAX_CHAR
+
+
+def _pages(aws_s3_client, bucket_name, prefix, start_after, versions):
+    if versions:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListObjectVersions.html
+        paginator = aws_s3_client.get_paginator("list_object_versions")
+        marker = {"KeyMarker": start_after} if start_after else {}
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, **marker):
+            markers = [{**marker, "IsDeleteMarker": True, "Size": 0} for marker in page.get("DeleteMarkers", [])]
+            # stable sort, the versions of a key stay newest first
+            yield sorted(page.get("Versions", []) + markers, key=lambda entry: entry["Key"])
+        return
+
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListObjectsV2.html
+    paginator = aws_s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, StartAfter=start_after):
+        yield page.get("Contents", [])
+
+
+def _list_range(aws_s3_client, bucket_name, prefix, start_after, end, versions, queue, stop):
+    # lists [start_after, end) into the queue page by page, None marks the end
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    try:
+        for entries in _pages(aws_s3_client, bucket_name, prefix, start_after, versions):
+            if end is not None and entries and entries[-1]["Key"] >= end:
+                put([entry for entry in entries if entry["Key"] < end])
+                break
+            if not put(entries):
+                return
+    except Exception as error:
+        put(error)
+        return
+    put(None)
+
+
+def iter_keys(aws_s3_client, bucket_name, prefix="", versions=False, shards=LIST_SHARDS, delimiter=None,
+              start_after="", concurrency=DEFAULT_CONCURRENCY):
+    # streams every key (or version and delete marker) under the prefix in key order.
+    # The key space is cut into disjoint ranges, either on the first character after
+    # the prefix or on the "folders" of one delimiter LIST, and the ranges are listed
+    # in parallel; reading them back in range order keeps the stream sorted.
+    plan = []
+    if delimiter:
+        entries, prefixes = list_shard(aws_s3_client, bucket_name, prefix, versions, delimiter)
+        plan += [(entry["Key"], entry) for entry in entries if entry["Key"] > start_after]
+        plan += [(shard, (shard, shard + MAX_CHAR)) for shard in prefixes if shard + MAX_CHAR > start_after]
+        plan.sort(key=lambda item: item[0])
+    else:
+        boundaries = [None] + character_boundaries(prefix, shards) + [None]
+        for lower, upper in zip(boundaries, boundaries[1:]):
+            if upper is None or upper > start_after:
+                plan.append((lower, (lower, upper)))
+
+    stop = Event()
+    queues = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        try:
+            for _, item in plan:
+                if isinstance(item, tuple):
+                    lower, upper = item
+                    shard_prefix, shard_start = (lower, "") if delimiter else (prefix, _before(lower) if lower else "")
+                    queue = queues[id(item)] = Queue(SHARD_BUFFER_PAGES)
+                    # ranges run in plan order, the one being read is always running
+                    executor.submit(_list_range, aws_s3_client, bucket_name, shard_prefix,
+                                    max(shard_start, start_after), upper, versions, queue, stop)
+
+            for _, item in plan:
+                if not isinstance(item, tuple):
+                    yield item
+                    continue
+                queue = queues[id(item)]
+                while (entries := queue.get()) is not None:
+                    if isinstance(entries, Exception):
+                        raise entries
+                    yield from entries
+        finally:
+            # lets blocked shards exit when the consumer stops early
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
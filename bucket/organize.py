@@ -1,21 +1,107 @@
-def object_per_extension(aws_s3_client, bucket_name):
-  for each in aws_s3_client.list_objects_v2(Bucket=bucket_name).get(
-      'Contents', []):
-    extension_folder = "unknown"
-    if '.' in each["Key"]:
-      extension_folder = each["Key"].split(".")[-1]
-      aws_s3_client.copy_object(Bucket=bucket_name,
-                                CopySource={
-                                  'Bucket': bucket_name,
-                                  'Key': each["Key"]
-                                },
-                                Key=f"{extension_folder}/{each['Key']}")
-      aws_s3_client.delete_object(Bucket=bucket_name, Key=each["Key"])
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from os import getenv, replace
+import json
+from bucket.index import is_indexed, refresh_index, indexed_pages
+from bucket.listing import iter_keys
+from object.batch import batches, delete_batch, MAX_DELETE_KEYS
+from object.multipart import DEFAULT_CONCURRENCY, server_side_copy
+
+
+CHECKPOINT_DIR = Path(getenv("organize_checkpoint_dir", ".organize"))
+
+
+def extension_folder(key) -> str:
+    name = key.rsplit("/", 1)[-1]
+    return name.split(".")[-1] if '.' in name else "unknown"
+
+
+def organized_key(key):
+    # None when the key already sits in its extension folder
+    folder = extension_folder(key)
+    if key.startswith(f"{folder}/"):
+        return None
+    return f"{folder}/{key}"
+
+
+def checkpoint_path(bucket_name) -> Path:
+    return CHECKPOINT_DIR / f"{bucket_name}.json"
+
+
+def load_checkpoint(bucket_name) -> str:
+    try:
+        with open(checkpoint_path(bucket_name)) as f:
+            return json.load(f)["start_after"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return ""
+
+
+def save_checkpoint(bucket_name, start_after):
+    path = checkpoint_path(bucket_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".tmp"), "w") as f:
+        json.dump({"start_after": start_after}, f)
+    replace(path.with_suffix(".tmp"), path)
+
+
+def _move_page(aws_s3_client, bucket_name, moves, executor, concurrency) -> list:
+    def copy(each):
+        server_side_copy(aws_s3_client, {'Bucket': bucket_name, 'Key': each["Key"]},
+                         bucket_name, each["Destination"], each["Size"], concurrency)
+        return {"Key": each["Key"]}
+
+    # only delete what was copied, a failed copy keeps its source
+    copied, failed = [], []
+    for each, future in [(each, executor.submit(copy, each)) for each in moves]:
+        if future.exception():
+            failed.append(each["Key"])
+            print(f"copy failed: {each['Key']}, {future.exception()}")
+        else:
+            copied.append(future.result())
+
+    # a page holds at most 1000 keys, exactly one delete_objects batch
+    if copied:
+        failed += [error["Key"] for error in delete_batch(aws_s3_client, bucket_name, copied)]
+    return failed
+
+
+def object_per_extension(aws_s3_client, bucket_name, dry_run=False, concurrency=DEFAULT_CONCURRENCY, resume=True,
+                         use_index=False):
+    start_after = load_checkpoint(bucket_name) if resume else ""
+    if start_after:
+        print(f"Resuming after: {start_after}")
+
+    if use_index:
+        if not is_indexed(bucket_name):
+            refresh_index(aws_s3_client, bucket_name, concurrency=concurrency)
+        pages = indexed_pages(bucket_name, start_after=start_after)
     else:
-      aws_s3_client.copy_object(Bucket=bucket_name,
-                                CopySource={
-                                  'Bucket': bucket_name,
-                                  'Key': each["Key"]
-                                },
-                                Key=f"{extension_folder}/{each['Key']}")
-      aws_s3_client.delete_object(Bucket=bucket_name, Key=each["Key"])
+        pages = ({"Contents": batch} for batch in batches(
+            iter_keys(aws_s3_client, bucket_name, start_after=start_after, concurrency=concurrency), MAX_DELETE_KEYS))
+
+    moved, failed = 0, []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for page in pages:
+            moves = []
+            for each in page.get("Contents", []):
+                destination = organized_key(each["Key"])
+                if destination:
+                    moves.append({"Key": each["Key"], "Destination": destination, "Size": each["Size"]})
+
+            if dry_run:
+                for each in moves:
+                    print(f"{each['Key']} -> {each['Destination']}")
+            elif moves:
+                failed += _move_page(aws_s3_client, bucket_name, moves, executor, concurrency)
+
+            moved += len(moves)
+            if page.get("Contents") and not dry_run:
+                save_checkpoint(bucket_name, page["Contents"][-1]["Key"])
+
+    if not dry_run:
+        # a finished run starts from the beginning next time
+        checkpoint_path(bucket_name).unlink(missing_ok=True)
+        if use_index and moved:
+            refresh_index(aws_s3_client, bucket_name, concurrency=concurrency)
+    print("{0} objects {1}, {2} failed".format(moved, "to move" if dry_run else "moved", len(failed)))
+    return failed
@@ -0,0 +1,184 @@
+from pathlib import Path
+import json
+from botocore.exceptions import ClientError
+from aio import DEFAULT_LIMIT, results_of
+from bucket.crud import create_bucket
+from bucket.encryption import set_bucket_encryption
+from bucket.policy import public_read_policy, multiple_policy
+from bucket.versioning import versioning
+
+
+# named policies of bucket/policy.py, a desired state can also hold the document itself
+POLICIES = {"public_read_policy": public_read_policy, "multiple_policy": multiple_policy}
+SETTINGS = ("versioning", "encryption", "policy")
+MISSING_CODES = ("404", "NoSuchBucket", "NotFound")
+# since January 2023 every bucket has SSE-S3 when nothing else is configured
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/default-encryption-faq.html
+DEFAULT_ENCRYPTION = {"SSEAlgorithm": "AES256"}
+
+
+def load_desired_state(path) -> dict:
+    # {"defaults": {...}, "buckets": {"name": {...}}}, every bucket's settings
+    # fall back to the defaults; an absent setting is left alone
+    with open(Path(path)) as f:
+        state = json.load(f)
+    defaults = state.get("defaults", {})
+    return {bucket_name: {**defaults, **(settings or {})} for bucket_name, settings in state["buckets"].items()}
+
+
+def _encryption(value):
+    # "AES256", "aws:kms" or {"SSEAlgorithm": ..., "KMSMasterKeyID": ...}
+    if not value:
+        return None
+    return {"SSEAlgorithm": value} if isinstance(value, str) else dict(value)
+
+
+def _policy(bucket_name, value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        if value not in POLICIES:
+            raise ValueError(f"Unknown policy '{value}', use one of {', '.join(POLICIES)} or a policy document")
+        return json.loads(POLICIES[value](bucket_name))
+    # "{bucket}" in the document is the bucket's name
+    return json.loads(json.dumps(value).replace("{bucket}", bucket_name))
+
+
+def _normalize(value):
+    # S3 hands policies back in its own shape: one-item lists become strings and
+    # "Principal": "*" becomes {"AWS": "*"}; strings and sorted lists compare equal
+    if isinstance(value, dict):
+        return {key: _normalize({"AWS": "*"} if key == "Principal" and item == "*" else item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_normalize(item) for item in value]
+        if len(items) == 1 and not isinstance(items[0], dict):
+            return items[0]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+
+def _comparable(setting, value):
+    if setting == "encryption":
+        return value or DEFAULT_ENCRYPTION
+    if setting == "policy" and value:
+        statements = value.get("Statement", [])
+        return _normalize({**value, "Statement": statements if isinstance(statements, list) else [statements]})
+    return value
+
+
+def _missing(error, *codes) -> bool:
+    return error.response["Error"]["Code"] in codes
+
+
+def fetch_state(aws_s3_client, bucket_name) -> dict:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/head_bucket.html
+    try:
+        aws_s3_client.head_bucket(Bucket=bucket_name)
+    except ClientError as error:
+        if _missing(error, *MISSING_CODES):
+            return {"exists": False}
+        raise
+
+    state = {"exists": True}
+    # a bucket that was never versioned has no Status, same as suspended for us
+    status = aws_s3_client.get_bucket_versioning(Bucket=bucket_name).get("Status")
+    state["versioning"] = status == "Enabled"
+
+    try:
+        rules = aws_s3_client.get_bucket_encryption(Bucket=bucket_name)["ServerSideEncryptionConfiguration"]["Rules"]
+        state["encryption"] = rules[0]["ApplyServerSideEncryptionByDefault"] if rules else None
+    except ClientError as error:
+        if not _missing(error, "ServerSideEncryptionConfigurationNotFoundError"):
+            raise
+        state["encryption"] = None
+
+    try:
+        state["policy"] = json.loads(aws_s3_client.get_bucket_policy(Bucket=bucket_name)["Policy"])
+    except ClientError as error:
+        if not _missing(error, "NoSuchBucketPolicy"):
+            raise
+        state["policy"] = None
+    return state
+
+
+def diff_state(bucket_name, desired, current) -> list:
+    # [{"setting", "current", "desired"}], only what has to change
+    changes = []
+    if not current["exists"]:
+        changes.append({"setting": "bucket", "current": None, "desired": desired.get("region")})
+        current = {"versioning": False, "encryption": None, "policy": None}
+
+    wanted = {
+        "versioning": bool(desired["versioning"]) if "versioning" in desired else None,
+        "encryption": _encryption(desired.get("encryption")),
+        "policy": _policy(bucket_name, desired.get("policy"))
+    }
+    for setting in SETTINGS:
+        if setting not in desired:
+            continue
+        if _comparable(setting, wanted[setting]) != _comparable(setting, current[setting]):
+            changes.append({"setting": setting, "current": current[setting], "desired": wanted[setting]})
+    return changes
+
+
+def apply_changes(aws_s3_client, bucket_name, changes):
+    # in order, the bucket has to exist before it is configured
+    for change in changes:
+        desired = change["desired"]
+        if change["setting"] == "bucket":
+            create_bucket(aws_s3_client, bucket_name, desired or aws_s3_client.meta.region_name)
+        elif change["setting"] == "versioning":
+            versioning(aws_s3_client, bucket_name, desired)
+        elif change["setting"] == "encryption":
+            if desired:
+                set_bucket_encryption(aws_s3_client, bucket_name, desired["SSEAlgorithm"],
+                                      desired.get("KMSMasterKeyID"))
+            else:
+                aws_s3_client.delete_bucket_encryption(Bucket=bucket_name)
+        elif change["setting"] == "policy":
+            if desired:
+                aws_s3_client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(desired))
+            else:
+                aws_s3_client.delete_bucket_policy(Bucket=bucket_name)
+    return len(changes)
+
+
+def _describe(value) -> str:
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else str(value)
+
+
+def provision(aws_s3_client, path, audit=False, limit=DEFAULT_LIMIT) -> dict:
+    # {bucket_name: [changes]}; audit only reports the drift
+    desired = load_desired_state(path)
+    # every bucket's state is fetched at the same time
+    current = results_of(lambda bucket_name: fetch_state(aws_s3_client, bucket_name), list(desired), limit)
+
+    plan, failed = {}, {}
+    for bucket_name in desired:
+        if isinstance(current[bucket_name], Exception):
+            failed[bucket_name] = current[bucket_name]
+            continue
+        changes = diff_state(bucket_name, desired[bucket_name], current[bucket_name])
+        if changes:
+            plan[bucket_name] = changes
+        for change in changes:
+            if change["setting"] == "bucket":
+                print(f" {bucket_name}: missing, to create in {change['desired'] or 'the client region'}")
+                continue
+            print(f" {bucket_name}: {change['setting']} {_describe(change['current'])} -> "
+                  f"{_describe(change['desired'])}")
+
+    if not audit and plan:
+        # buckets are configured concurrently, each one's changes in order
+        applied = results_of(lambda bucket_name: apply_changes(aws_s3_client, bucket_name, plan[bucket_name]),
+                             list(plan), limit)
+        failed.update({bucket_name: result for bucket_name, result in applied.items()
+                       if isinstance(result, Exception)})
+
+    for bucket_name, error in failed.items():
+        print(f" {bucket_name} failed: {error}")
+    print("{0} buckets, {1} {2}, {3} failed".format(
+        len(desired), len([bucket_name for bucket_name in plan if bucket_name not in failed]),
+        "drifted" if audit else "changed", len(failed)))
+    return plan
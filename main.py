@@ -6,11 +6,25 @@ from bucket.policy import read_bucket_policy, assign_policy
 from bucket.versioning import versioning
 from bucket.encryption import set_bucket_encryption, read_bucket_encryption
 from bucket.organize import object_per_extension
+from bucket.index import refresh_index
+from bucket.provision import provision
+from bucket.inventory import inventory, print_report, write_report
 from object.crud import download_file_and_upload_to_s3, get_objects, upload_local_file, upload_local_file_to_folder
-from object.versioning import list_object_versions, rollback_to_version, delete_old_files
-from my_args import bucket_arguments, object_arguments
-from object.policy import set_object_access_policy
+from object.versioning import list_object_versions, rollback_to_version, delete_old_files, restore_to_time
+from my_args import bucket_arguments, object_arguments, sync_arguments, serve_arguments, client_arguments, \
+    metrics_arguments, batch_arguments, provision_arguments, copy_arguments
+from object.policy import set_object_access_policy, set_prefix_access_policy
+from object.multipart import list_incomplete_uploads, abort_incomplete_uploads, ABORT_AFTER_DAYS
+from object.sync import sync
+from object.download import download_object
+from object.transfer import copy_prefix, parse_location
+from server import serve, forward
+from manifest import run_manifest
+from metrics import serve_metrics, write_summary, write_textfile
+from datetime import datetime, timezone
+from os import getenv
 import argparse
+import sys
 
 
 parser = argparse.ArgumentParser(
@@ -19,17 +33,31 @@ parser = argparse.ArgumentParser(
     epilog='DEMO APP - 2 FOR BTU_AWS'
 )
 
+parser.add_argument(
+    "--remote",
+    type=str,
+    help="URL of a running `main.py serve`, e.g. http://127.0.0.1:8765",
+    default=getenv("s3_cli_server")
+)
+
+client_arguments(parser)
+metrics_arguments(parser)
+
 subparsers = parser.add_subparsers(dest='command')
 
 bucket = bucket_arguments(subparsers.add_parser("bucket", help="work with Bucket/s"))
 object = object_arguments(subparsers.add_parser("object", help="work with Object/s"))
 list_bucket = subparsers.add_parser("list_buckets", help="List already created buckets.")
+sync_parser = sync_arguments(subparsers.add_parser("sync", help="Sync a local directory with a bucket prefix."))
+serve_parser = serve_arguments(subparsers.add_parser("serve", help="Keep one client warm and run commands over HTTP."))
+provision_parser = provision_arguments(subparsers.add_parser(
+    "provision", help="Bring buckets to a desired state (versioning, encryption, policy), or audit them."))
+cp_parser = copy_arguments(subparsers.add_parser("cp", help="Server-side copy of a prefix to another prefix or bucket."))
+mv_parser = copy_arguments(subparsers.add_parser("mv", help="Like cp, then delete the copied sources."))
+batch_parser = batch_arguments(subparsers.add_parser("batch", help="Run the commands of a JSONL/CSV manifest."))
 
 
-def main():
-    s3_client = init_client()
-    args = parser.parse_args()
-
+def run(s3_client, args):
     match args.command:
 
         case "bucket":
@@ -48,8 +76,12 @@ def main():
             if args.read_policy == "True":
                 print(read_bucket_policy(s3_client, args.name))
 
+            if args.refresh_index:
+                refresh_index(s3_client, args.name, concurrency=args.concurrency)
+                refresh_index(s3_client, args.name, versions=True, concurrency=args.concurrency)
+
             if (args.list_objects == "True"):
-                get_objects(s3_client, args.bucket_name)
+                get_objects(s3_client, args.name, args.use_index)
 
             if args.assign_read_policy == "True":
                 assign_policy(s3_client, "public_read_policy", args.name)
@@ -77,32 +109,102 @@ def main():
                 print("Disabled versioning on bucket %s." % args.name)
 
             if args.set_object_access_policy == "True":
-                set_object_access_policy(s3_client, args.name, "important.txt")
-                print("set access policy")
+                if args.prefix is not None:
+                    set_prefix_access_policy(s3_client, args.name, args.prefix, args.acl, args.dry_run,
+                                             args.concurrency, args.rate)
+                else:
+                    set_object_access_policy(s3_client, args.name, "important.txt")
+                    print("set access policy")
+
+            if args.organize_bucket:
+                object_per_extension(s3_client, args.name, args.dry_run, args.concurrency, use_index=args.use_index)
+
+            if args.inventory:
+                report = inventory(s3_client, args.name, args.prefix or "", args.depth, args.top, args.use_index,
+                                   args.concurrency)
+                print_report(report)
+                if args.report:
+                    write_report(report, args.report, args.report_format)
+
+            if args.list_uploads:
+                for upload in list_incomplete_uploads(s3_client, args.name, args.older_than or 0):
+                    print(f' Key: {upload["Key"]}, UploadId: {upload["UploadId"]}, Initiated: {upload["Initiated"]}')
+
+            if args.abort_uploads:
+                older_than = ABORT_AFTER_DAYS if args.older_than is None else args.older_than
+                for upload in abort_incomplete_uploads(s3_client, args.name, older_than):
+                    print(f' Aborted: {upload["Key"]}, UploadId: {upload["UploadId"]}')
 
         case "object":
+            part_size = args.part_size * 1024 * 1024 if args.part_size else None
+
             if args.object_link:
                 if (args.download_upload == "True"):
-                    print(download_file_and_upload_to_s3(s3_client, args.bucket_name, args.object_link, args.keep_file_name))
+                    print(download_file_and_upload_to_s3(s3_client, args.bucket_name, args.object_link, args.keep_file_name,
+                                                         part_size=part_size, concurrency=args.concurrency,
+                                                         key_template=args.key_template))
 
             if args.local_object:
-                print(upload_local_file(s3_client, args.bucket_name, args.local_object, args.keep_file_name, args.upload_type))
+                print(upload_local_file(s3_client, args.bucket_name, args.local_object, args.keep_file_name, args.upload_type,
+                                        part_size, args.concurrency, args.resume, args.dedup, args.key_template,
+                                        args.compress, args.compress_level))
             
             if args.local_object_to_folder:
-                print(upload_local_file_to_folder(s3_client, args.bucket_name, args.local_object_to_folder, args.folder_name))
+                print(upload_local_file_to_folder(s3_client, args.bucket_name, args.local_object_to_folder, args.folder_name,
+                                                  args.compress, args.compress_level))
+
+            if args.refresh_index:
+                refresh_index(s3_client, args.bucket_name, args.name or "", concurrency=args.concurrency)
+                refresh_index(s3_client, args.bucket_name, args.name or "", True, args.concurrency)
+
+            if args.point_in_time:
+                point_in_time = datetime.fromisoformat(args.point_in_time)
+                # a time without an offset is UTC, like S3's LastModified
+                if point_in_time.tzinfo is None:
+                    point_in_time = point_in_time.replace(tzinfo=timezone.utc)
+                restore_to_time(s3_client, args.bucket_name, args.name or "", point_in_time, args.delete_absent,
+                                args.dry_run, args.concurrency)
 
             if args.name:
                 if args.list_versions:
-                    list_object_versions(s3_client, args.bucket_name, args.name)
+                    list_object_versions(s3_client, args.bucket_name, args.name, args.use_index)
 
                 if args.delete_old_files:
-                    delete_old_files(s3_client, args.bucket_name, args.name)
+                    delete_old_files(s3_client, args.bucket_name, args.name, args.older_than_days, args.keep_newest,
+                                     args.noncurrent_only, args.dry_run, args.concurrency)
+
+                if args.download:
+                    print(download_object(s3_client, args.bucket_name, args.name, args.output, args.version_id,
+                                          part_size, args.concurrency, decompress=not args.raw))
 
                 if args.roll_back_to:
                     print(args.name)
                     rollback_to_version(s3_client, args.bucket_name, args.name, args.roll_back_to)
 
 
+        case "sync":
+            sync(s3_client, args.bucket_name, args.local_dir, args.prefix, args.direction, args.delete,
+                 args.dry_run, args.concurrency)
+
+        case "cp" | "mv":
+            source_bucket, source_prefix = parse_location(args.source)
+            bucket_name, prefix = parse_location(args.destination)
+            destination_client = s3_client
+            if args.destination_region and args.destination_region != s3_client.meta.region_name:
+                # copy requests go to the destination's region, listing and deletes stay here
+                destination_client = init_client(args.endpoint_url, region_name=args.destination_region,
+                                                 max_pool_connections=args.max_pool_connections,
+                                                 workers=args.concurrency,
+                                                 connect_timeout=args.connect_timeout,
+                                                 read_timeout=args.read_timeout,
+                                                 retry_mode=args.retry_mode,
+                                                 max_attempts=args.max_attempts)
+            copy_prefix(destination_client, source_bucket, source_prefix, bucket_name, prefix,
+                        args.command == "mv", args.verify, args.dry_run, args.concurrency, s3_client)
+
+        case "provision":
+            provision(s3_client, args.state, args.audit, args.concurrency)
+
         case "list_buckets":
             buckets = list_buckets(s3_client)
             if buckets:
@@ -110,6 +212,45 @@ def main():
                     print(f' Name:  {bucket["Name"]}')
 
 
+def main():
+    args = parser.parse_args()
+
+    # a running `serve` process already holds a warm client, just hand it the command
+    if args.remote and args.command not in ("serve", "batch"):
+        forward(args.remote, sys.argv[1:])
+        return
+
+    s3_client = init_client(args.endpoint_url, args.check_credentials,
+                            max_pool_connections=args.max_pool_connections,
+                            workers=getattr(args, "concurrency", 0),
+                            connect_timeout=args.connect_timeout,
+                            read_timeout=args.read_timeout,
+                            retry_mode=args.retry_mode,
+                            max_attempts=args.max_attempts)
+
+    if args.metrics_port:
+        serve_metrics(int(args.metrics_port))
+
+    try:
+        if args.command == "serve":
+            serve(s3_client, args.host, args.port)
+            return
+
+        if args.command == "batch":
+            # with --remote every item is forwarded, the manifest stays local
+            run_manifest(s3_client, args.manifest, args.format, args.concurrency, args.attempts,
+                         args.results, args.failures, args.remote)
+            return
+
+        run(s3_client, args)
+    finally:
+        # failed runs are the ones worth looking at
+        if args.metrics_json:
+            write_summary(args.metrics_json)
+        if args.metrics_textfile:
+            write_textfile(args.metrics_textfile)
+
+
 if __name__ == "__main__":
     try:
         main()
@@ -0,0 +1,110 @@
+from itertools import groupby
+from pathlib import Path
+from time import perf_counter, sleep
+import csv
+import json
+import random
+import shlex
+from aio import is_transient, run_bounded
+from server import capture_output, forward, install_thread_output
+
+
+DEFAULT_ATTEMPTS = 3
+# commands that can't run as a manifest item
+NOT_BATCHABLE = (None, "serve", "batch")
+
+
+def _argv(value) -> list:
+    # an argv list, or one command line as it would be typed after main.py
+    return shlex.split(value) if isinstance(value, str) else [str(each) for each in value]
+
+
+def _item(line, item) -> dict:
+    return {"id": str(item.get("id") or line), "argv": _argv(item["argv"]), "stage": int(item.get("stage") or 0)}
+
+
+def read_manifest(path, manifest_format=None):
+    # JSONL: {"id": "...", "argv": [...], "stage": 0} per line,
+    # CSV: an `argv` column and optional `id` and `stage` ones
+    path = Path(path)
+    manifest_format = manifest_format or ("csv" if path.suffix.lower() == ".csv" else "jsonl")
+    with open(path, newline="") as f:
+        if manifest_format == "csv":
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield _item(line, row)
+            return
+
+        for line, text in enumerate(f, start=1):
+            if not text.strip() or text.lstrip().startswith("#"):
+                continue
+            item = json.loads(text)
+            yield _item(line, item if isinstance(item, dict) else {"argv": item})
+
+
+def run_item(s3_client, item, attempts=DEFAULT_ATTEMPTS, base_delay=0.5, remote=None) -> dict:
+    # imported here, main.py imports this module for `batch`
+    from main import parser, run
+
+    result = {"id": item["id"], "argv": item["argv"], "attempts": 0, "error": None}
+    started = perf_counter()
+    with capture_output() as output:
+        for attempt in range(attempts):
+            result["attempts"] = attempt + 1
+            try:
+                if remote:
+                    forward(remote, item["argv"])
+                else:
+                    args = parser.parse_args(item["argv"])
+                    if args.command in NOT_BATCHABLE:
+                        raise ValueError(f"Can't run '{args.command}' from a manifest")
+                    run(s3_client, args)
+                result["error"] = None
+                break
+            except SystemExit as exit:
+                # argparse errors and parser.error(), retrying won't help
+                message = output.getvalue().strip().rsplit("\n", 1)[-1]
+                result["error"] = None if exit.code == 0 else (message if "error:" in message else "invalid arguments")
+                break
+            except Exception as error:
+                result["error"] = f"{type(error).__name__}: {error}"
+                if not is_transient(error) or attempt == attempts - 1:
+                    break
+                sleep(random.uniform(0, base_delay * 2 ** attempt))
+        result["output"] = output.getvalue()
+    result["status"] = "failed" if result["error"] else "ok"
+    result["seconds"] = perf_counter() - started
+    return result
+
+
+def run_manifest(s3_client, path, manifest_format=None, concurrency=8, attempts=DEFAULT_ATTEMPTS,
+                 results_path=None, failures_path=None, remote=None) -> dict:
+    # every item shares one client and its connection pool, the startup cost is paid once
+    install_thread_output()
+    results_path = Path(results_path or f"{path}.results.jsonl")
+    failures_path = Path(failures_path or f"{path}.failures.jsonl")
+    report = {"succeeded": 0, "failed": 0, "retried": 0}
+
+    with open(results_path, "w") as results, open(failures_path, "w") as failures:
+        def collect(item, result, error):
+            # runs on the event loop thread, the files need no lock
+            if error:
+                result = {"id": item["id"], "argv": item["argv"], "attempts": 0, "status": "failed",
+                          "error": f"{type(error).__name__}: {error}", "output": ""}
+            report["failed" if result["status"] == "failed" else "succeeded"] += 1
+            report["retried"] += result["attempts"] > 1
+            results.write(json.dumps(result) + "\n")
+            if result["status"] == "failed":
+                # same shape as the manifest, the failures file can be run again as is
+                failures.write(json.dumps({"id": item["id"], "argv": item["argv"], "error": result["error"]}) + "\n")
+                print(f"{item['id']} failed: {result['error']}")
+
+        # consecutive items of a stage run concurrently, the next stage starts
+        # once they all finished (e.g. create the buckets, then upload into them)
+        for _, stage in groupby(read_manifest(path, manifest_format), key=lambda item: item["stage"]):
+            run_bounded(lambda item: run_item(s3_client, item, attempts, remote=remote), stage, concurrency, collect)
+
+    print("{0} succeeded, {1} failed, {2} retried; results in {3}".format(
+        report["succeeded"], report["failed"], report["retried"], results_path))
+    if report["failed"]:
+        print(f"Failed items in {failures_path}")
+    return report
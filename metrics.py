@@ -0,0 +1,210 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import replace
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+import json
+import sys
+from aio import SCHEDULER
+
+
+# seconds, same default buckets as the Prometheus client libraries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    # request counts, errors, retries, latency histograms and bytes per S3 operation
+    def __init__(self):
+        self.lock = Lock()
+        self.started = monotonic()
+        self.operations = {}
+
+    def _operation(self, name) -> dict:
+        if name not in self.operations:
+            self.operations[name] = {
+                "requests": 0, "errors": {}, "retries": 0, "bytes_in": 0, "bytes_out": 0,
+                "latency_sum": 0.0, "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1)
+            }
+        return self.operations[name]
+
+    def observe(self, name, latency, error_code=None, retries=0, bytes_in=0, bytes_out=0):
+        with self.lock:
+            operation = self._operation(name)
+            operation["requests"] += 1
+            operation["retries"] += retries
+            operation["bytes_in"] += bytes_in
+            operation["bytes_out"] += bytes_out
+            operation["latency_sum"] += latency
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+            operation["latency_buckets"][bucket] += 1
+            if error_code:
+                operation["errors"][error_code] = operation["errors"].get(error_code, 0) + 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            elapsed = monotonic() - self.started
+            operations = json.loads(json.dumps(self.operations))
+        for operation in operations.values():
+            operation["latency_avg"] = operation["latency_sum"] / operation["requests"] if operation["requests"] else 0
+            operation["latency_p50"] = _quantile(operation["latency_buckets"], 0.5)
+            operation["latency_p99"] = _quantile(operation["latency_buckets"], 0.99)
+            operation["latency_buckets"] = dict(zip(map(str, LATENCY_BUCKETS + ("+Inf",)), operation["latency_buckets"]))
+        return {"elapsed": elapsed, "operations": operations}
+
+    def prometheus(self) -> str:
+        # https://prometheus.io/docs/instrumenting/exposition_formats/
+        lines = []
+        with self.lock:
+            for name, operation in sorted(self.operations.items()):
+                label = f'operation="{name}"'
+                lines.append(f"s3_requests_total{{{label}}} {operation['requests']}")
+                lines.append(f"s3_retries_total{{{label}}} {operation['retries']}")
+                lines.append(f"s3_bytes_in_total{{{label}}} {operation['bytes_in']}")
+                lines.append(f"s3_bytes_out_total{{{label}}} {operation['bytes_out']}")
+                for code, count in sorted(operation["errors"].items()):
+                    lines.append(f's3_errors_total{{{label},code="{code}"}} {count}')
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), operation["latency_buckets"]):
+                    cumulative += count
+                    lines.append(f's3_request_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"s3_request_seconds_sum{{{label}}} {operation['latency_sum']}")
+                lines.append(f"s3_request_seconds_count{{{label}}} {operation['requests']}")
+        # the adaptive window the bulk paths currently share, see aio.py
+        scheduler = SCHEDULER.summary()
+        lines.append(f"s3_scheduler_limit {scheduler['limit']}")
+        lines.append(f"s3_scheduler_in_flight {scheduler['in_flight']}")
+        lines.append(f"s3_scheduler_throttles_total {scheduler['throttles']}")
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(buckets, q):
+    # upper bound of the bucket holding the q-th request
+    total = sum(buckets)
+    if not total:
+        return 0
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+        seen += count
+        if seen >= q * total:
+            return bound
+
+
+METRICS = Metrics()
+
+
+def instrument(client, metrics=METRICS):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/events.html
+    def before_call(context, **kwargs):
+        context["metrics_started"] = perf_counter()
+
+    def request_created(request, operation_name, **kwargs):
+        # once per attempt, retries included; aws-chunked bodies (flexible
+        # checksums) carry their real length in a separate header
+        headers = request.headers
+        length = int(headers.get("X-Amz-Decoded-Content-Length") or headers.get("Content-Length") or 0)
+        request.context["metrics_bytes_out"] = request.context.get("metrics_bytes_out", 0) + length
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        metadata = parsed.get("ResponseMetadata", {})
+        # a HEAD response announces the object's length without sending it
+        has_body = model.http.get("method") != "HEAD"
+        metrics.observe(
+            model.name,
+            perf_counter() - context.get("metrics_started", perf_counter()),
+            parsed.get("Error", {}).get("Code"),
+            metadata.get("RetryAttempts", 0),
+            int(http_response.headers.get("content-length", 0) or 0) if has_body else 0,
+            context.get("metrics_bytes_out", 0)
+        )
+
+    def after_call_error(model, context, exception, **kwargs):
+        # connection errors never get an HTTP response
+        metrics.observe(model.name, perf_counter() - context.get("metrics_started", perf_counter()),
+                        type(exception).__name__)
+
+    client.meta.events.register("before-call.s3", before_call)
+    client.meta.events.register("request-created.s3", request_created)
+    client.meta.events.register("after-call.s3", after_call)
+    client.meta.events.register("after-call-error.s3", after_call_error)
+    return client
+
+
+class Progress:
+    # one line progress bar on stderr, redrawn at most 10 times a second
+    def __init__(self, total_bytes=None, label="", stream=None):
+        self.total_bytes = total_bytes
+        self.label = label
+        # looked up late, `serve` swaps sys.stderr for a per-request one
+        self.stream = stream
+        self.done_bytes = 0
+        self.started = self.drawn = monotonic()
+        self.finished = False
+        self.lock = Lock()
+
+    def update(self, done_bytes):
+        with self.lock:
+            self.done_bytes += done_bytes
+            now = monotonic()
+            if self.finished:
+                return
+            self.finished = self.total_bytes is not None and self.done_bytes >= self.total_bytes
+            if now - self.drawn < 0.1 and not self.finished:
+                return
+            self._draw(now)
+
+    def close(self):
+        # the last line and its newline, a bar without a total can't tell it is done
+        with self.lock:
+            if not self.finished:
+                self.finished = True
+                self._draw(monotonic())
+
+    def _draw(self, now):
+        self.drawn = now
+        stream = self.stream or sys.stderr
+        stream.write("\r" + self.line(now))
+        if self.finished:
+            stream.write("\n")
+        stream.flush()
+
+    def line(self, now=None) -> str:
+        elapsed = max((now or monotonic()) - self.started, 1e-9)
+        speed = self.done_bytes / elapsed / 1024 / 1024
+        if not self.total_bytes:
+            return f"{self.label} {self.done_bytes / 1024 / 1024:.1f} MiB {speed:.1f} MB/s"
+        ratio = min(self.done_bytes / self.total_bytes, 1)
+        bar = "#" * int(ratio * 30)
+        return f"{self.label} [{bar:<30}] {ratio:6.1%} {speed:.1f} MB/s"
+
+
+def write_textfile(path, metrics=METRICS):
+    # for node_exporter's textfile collector, replaced atomically
+    with open(f"{path}.tmp", "w") as f:
+        f.write(metrics.prometheus())
+    replace(f"{path}.tmp", path)
+
+
+def write_summary(path, metrics=METRICS):
+    summary = json.dumps({**metrics.summary(), "scheduler": SCHEDULER.summary()}, indent=2)
+    if path == "-":
+        print(summary, file=sys.stderr)
+        return
+    with open(path, "w") as f:
+        f.write(summary)
+
+
+def serve_metrics(port, host="127.0.0.1", metrics=METRICS):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.end_headers()
+            if self.path == "/metrics":
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
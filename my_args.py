@@ -1,4 +1,96 @@
 from os import getenv
+from object.multipart import DEFAULT_CONCURRENCY
+from aio import DEFAULT_LIMIT
+
+
+def client_arguments(parser):
+    # unset options fall back to the aws_* variables in .env, see auth.py
+    parser.add_argument(
+        "-e_u",
+        "--endpoint_url",
+        type=str,
+        help="custom S3 endpoint, e.g. a local S3 stand-in",
+        default=None
+    )
+
+    parser.add_argument(
+        "-m_p_c",
+        "--max_pool_connections",
+        type=int,
+        help="size of the HTTP connection pool",
+        default=None
+    )
+
+    parser.add_argument(
+        "-c_t",
+        "--connect_timeout",
+        type=float,
+        help="connect timeout in seconds",
+        default=None
+    )
+
+    parser.add_argument(
+        "-r_t",
+        "--read_timeout",
+        type=float,
+        help="read timeout in seconds",
+        default=None
+    )
+
+    parser.add_argument(
+        "-r_m",
+        "--retry_mode",
+        type=str,
+        help="botocore retry mode",
+        choices=["legacy", "standard", "adaptive"],
+        default=None
+    )
+
+    parser.add_argument(
+        "-m_a",
+        "--max_attempts",
+        type=int,
+        help="attempts per request, retries included",
+        default=None
+    )
+
+    parser.add_argument(
+        "-c_cr",
+        "--check_credentials",
+        help="check the credentials with list_buckets before running the command",
+        action='store_true',
+        default=None
+    )
+
+    return parser
+
+
+def metrics_arguments(parser):
+    parser.add_argument(
+        "-m_j",
+        "--metrics_json",
+        type=str,
+        help="write a JSON summary of the S3 calls at exit, '-' for stderr",
+        default=getenv("metrics_json")
+    )
+
+    parser.add_argument(
+        "-m_t",
+        "--metrics_textfile",
+        type=str,
+        help="write the metrics in Prometheus text format at exit, e.g. for node_exporter",
+        default=getenv("metrics_textfile")
+    )
+
+    parser.add_argument(
+        "-m_pt",
+        "--metrics_port",
+        type=int,
+        help="serve the metrics on http://127.0.0.1:<port>/metrics while running",
+        default=getenv("metrics_port")
+    )
+
+    return parser
 
 
 def bucket_arguments(parser):
@@ -19,6 +111,32 @@ def bucket_arguments(parser):
         default="False"
     )
 
+    parser.add_argument(
+        "-pfx",
+        "--prefix",
+        type=str,
+        help="with -soap, apply the ACL to every object under this prefix ('' for the whole bucket)",
+        default=None
+    )
+
+    parser.add_argument(
+        "-acl",
+        "--acl",
+        type=str,
+        help="canned ACL applied by -soap",
+        choices=["private", "public-read", "public-read-write", "authenticated-read",
+                 "bucket-owner-read", "bucket-owner-full-control"],
+        default="public-read"
+    )
+
+    parser.add_argument(
+        "-rate",
+        "--rate",
+        type=float,
+        help="max requests per second for bulk operations",
+        default=None
+    )
+
     parser.add_argument(
         "-cb",
         "--create_bucket",
@@ -152,6 +270,98 @@ def bucket_arguments(parser):
         action='store_true'
     )
 
+    parser.add_argument(
+        "-u_i",
+        "--use_index",
+        help="answer listings from the local index, filled on first use",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-r_i",
+        "--refresh_index",
+        help="refresh the local index of objects and versions",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-d_r",
+        "--dry_run",
+        help="only print what organize would do",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="number of objects processed in parallel",
+        default=DEFAULT_CONCURRENCY
+    )
+
+    parser.add_argument(
+        "-l_u",
+        "--list_uploads",
+        help="list incomplete multipart uploads",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-a_u",
+        "--abort_uploads",
+        help="abort incomplete multipart uploads",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-o_t",
+        "--older_than",
+        type=int,
+        help="only incomplete uploads started more than N days ago, "
+             "0 for all; --abort_uploads defaults to 1 so running uploads are left alone",
+        default=None
+    )
+
+    parser.add_argument(
+        "-inv",
+        "--inventory",
+        help="sizes and counts by prefix, extension, storage class and age, versions included (--prefix narrows it)",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-dep",
+        "--depth",
+        type=int,
+        help="with --inventory, folders per prefix group",
+        default=1
+    )
+
+    parser.add_argument(
+        "-top",
+        "--top",
+        type=int,
+        help="with --inventory, number of largest objects to list",
+        default=10
+    )
+
+    parser.add_argument(
+        "-rep",
+        "--report",
+        type=str,
+        help="with --inventory, write the full report to this .json or .csv file",
+        default=None
+    )
+
+    parser.add_argument(
+        "-r_f",
+        "--report_format",
+        type=str,
+        help="report format, taken from the file extension by default",
+        choices=["json", "csv"],
+        default=None
+    )
+
     return parser
 
 
@@ -219,6 +429,61 @@ def object_arguments(parser):
         choices=["upload_file", "upload_fileobj", "put_object", "multipart_upload"]
     )
 
+    parser.add_argument(
+        "-cmp",
+        "--compress",
+        type=str,
+        help="compress uploads client side, skipped for already compressed types (zstd needs zstandard)",
+        choices=["gzip", "zstd"],
+        default=getenv("compress")
+    )
+
+    parser.add_argument(
+        "-c_l",
+        "--compress_level",
+        type=int,
+        help="compression level, 6 for gzip and 3 for zstd by default",
+        default=None
+    )
+
+    parser.add_argument(
+        "-p_s",
+        "--part_size",
+        type=int,
+        help="multipart part size in MiB, grown automatically to stay under 10,000 parts",
+        default=None
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="number of parts uploaded in parallel",
+        default=DEFAULT_CONCURRENCY
+    )
+
+    parser.add_argument(
+        "-k_t",
+        "--key_template",
+        type=str,
+        help="generated key template, e.g. '{hash}/{date}/{id}.{ext}', 'legacy' for the old md5(localtime) name",
+        default=None
+    )
+
+    parser.add_argument(
+        "-d_d",
+        "--dedup",
+        help="skip the upload (or copy server side) when the bucket already holds the same content",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-r_u",
+        "--resume",
+        help="journal multipart upload progress and resume an interrupted upload",
+        action='store_true'
+    )
+
     parser.add_argument(
         "-f_n",
         "--folder_name",
@@ -240,6 +505,66 @@ def object_arguments(parser):
         action='store_true'
     )
 
+    parser.add_argument(
+        "-o_t_d",
+        "--older_than_days",
+        type=int,
+        help="delete versions older than N days, 6 months by default",
+        default=None
+    )
+
+    parser.add_argument(
+        "-k_n",
+        "--keep_newest",
+        type=int,
+        help="always keep the newest N versions of every key",
+        default=None
+    )
+
+    parser.add_argument(
+        "-n_o",
+        "--noncurrent_only",
+        help="never delete the current version",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-d_r",
+        "--dry_run",
+        help="only print what would be deleted",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-dl",
+        "--download",
+        help="download the object in parallel byte ranges, resumes an interrupted download",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-raw",
+        "--raw",
+        help="keep a compressed object compressed on download",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-out",
+        "--output",
+        type=str,
+        help="download destination, static/<name> by default",
+        default=None
+    )
+
+    parser.add_argument(
+        "-v_id",
+        "--version_id",
+        type=str,
+        help="download this version of the object",
+        default=None
+    )
+
     parser.add_argument(
         "-r_b_t",
         "--roll_back_to",
@@ -248,4 +573,235 @@ def object_arguments(parser):
         default=None
     )
 
+    parser.add_argument(
+        "-pit",
+        "--point_in_time",
+        type=str,
+        help="restore every key under --name (a prefix, the whole bucket if unset) "
+             "to its version at this ISO time, e.g. 2026-10-01T12:00:00+00:00",
+        default=None
+    )
+
+    parser.add_argument(
+        "-d_a",
+        "--delete_absent",
+        help="with --point_in_time, also delete keys that didn't exist at that time",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-u_i",
+        "--use_index",
+        help="answer listings from the local index, filled on first use",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-r_i",
+        "--refresh_index",
+        help="refresh the local index of objects and versions",
+        action='store_true'
+    )
+
+    return parser
+
+
+def sync_arguments(parser):
+    parser.add_argument(
+        'bucket_name',
+        type=str,
+        help="Pass bucket name."
+    )
+
+    parser.add_argument(
+        "-l_d",
+        "--local_dir",
+        type=str,
+        help="local directory to sync",
+        default="static"
+    )
+
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        type=str,
+        help="bucket prefix to sync with, e.g. 'static/'",
+        default=""
+    )
+
+    parser.add_argument(
+        "-dir",
+        "--direction",
+        type=str,
+        help="upload: local dir -> bucket, download: bucket -> local dir",
+        choices=["upload", "download"],
+        default="upload"
+    )
+
+    parser.add_argument(
+        "-del",
+        "--delete",
+        help="delete files missing on the source side",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-d_r",
+        "--dry_run",
+        help="only print what would be transferred or deleted",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="number of files transferred in parallel",
+        default=DEFAULT_CONCURRENCY
+    )
+
+    return parser
+
+
+def copy_arguments(parser):
+    parser.add_argument(
+        'source',
+        type=str,
+        help="bucket/prefix to copy from, e.g. 'photos/2023/' or 's3://photos/2023/'"
+    )
+
+    parser.add_argument(
+        'destination',
+        type=str,
+        help="bucket/prefix to copy to, the part of each key after the source prefix is kept"
+    )
+
+    parser.add_argument(
+        "-d_rg",
+        "--destination_region",
+        type=str,
+        help="region of the destination bucket when it differs from the client's, "
+             "the copies are sent there",
+        default=None
+    )
+
+    parser.add_argument(
+        "-ver",
+        "--verify",
+        help="check every copy's size and ETag (or content) against the source, "
+             "a move only deletes verified sources",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-d_r",
+        "--dry_run",
+        help="only print what would be copied",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="number of objects copied in parallel",
+        default=DEFAULT_CONCURRENCY
+    )
+
+    return parser
+
+
+def serve_arguments(parser):
+    parser.add_argument(
+        "-host",
+        "--host",
+        type=str,
+        help="address to listen on",
+        default=getenv("s3_cli_host", "127.0.0.1")
+    )
+
+    parser.add_argument(
+        "-port",
+        "--port",
+        type=int,
+        help="port to listen on",
+        default=int(getenv("s3_cli_port", 8765))
+    )
+
+    return parser
+
+
+def batch_arguments(parser):
+    parser.add_argument(
+        'manifest',
+        type=str,
+        help="JSONL ({\"id\": ..., \"argv\": [...]} per line) or CSV (id, argv columns) of commands"
+    )
+
+    parser.add_argument(
+        "-fmt",
+        "--format",
+        type=str,
+        help="manifest format, taken from the file extension by default",
+        choices=["jsonl", "csv"],
+        default=None
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="manifest items run at the same time",
+        default=DEFAULT_CONCURRENCY
+    )
+
+    parser.add_argument(
+        "-att",
+        "--attempts",
+        type=int,
+        help="attempts per item, throttled and connection errors are retried",
+        default=3
+    )
+
+    parser.add_argument(
+        "-res",
+        "--results",
+        type=str,
+        help="per item results as JSONL, <manifest>.results.jsonl by default",
+        default=None
+    )
+
+    parser.add_argument(
+        "-fail",
+        "--failures",
+        type=str,
+        help="failed items in manifest format, <manifest>.failures.jsonl by default",
+        default=None
+    )
+
+    return parser
+
+
+def provision_arguments(parser):
+    parser.add_argument(
+        'state',
+        type=str,
+        help="JSON desired state: {\"defaults\": {...}, \"buckets\": {\"name\": {\"versioning\": true, ...}}}"
+    )
+
+    parser.add_argument(
+        "-aud",
+        "--audit",
+        help="only report the drift, change nothing",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "-c_c",
+        "--concurrency",
+        type=int,
+        help="buckets fetched and configured at the same time",
+        default=DEFAULT_LIMIT
+    )
+
     return parser
@@ -0,0 +1,44 @@
+from collections import Counter
+from itertools import islice
+from aio import SCHEDULER, THROTTLE_CODES, rate_key
+
+
+# https://docs.aws.amazon.com/AmazonS3/latest/API/API_DeleteObjects.html
+MAX_DELETE_KEYS = 1000
+RETRY_CODES = THROTTLE_CODES + ("InternalError",)
+
+
+def batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def _busiest_prefix(bucket_name, objects) -> str:
+    # a batch can span prefixes, it is paced as the one most of its keys are under
+    prefixes = Counter(rate_key(bucket_name, each["Key"]) for each in objects)
+    return prefixes.most_common(1)[0][0] if prefixes else rate_key(bucket_name)
+
+
+def delete_batch(aws_s3_client, bucket_name, objects, attempts=5) -> list:
+    # objects: [{"Key": ..., "VersionId": ...}, ...], at most 1000, returns the failed ones
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
+    failed = []
+    for attempt in range(attempts):
+        response = SCHEDULER.call(
+            _busiest_prefix(bucket_name, objects),
+            aws_s3_client.delete_objects,
+            Bucket=bucket_name,
+            Delete={"Objects": objects, "Quiet": True}
+        )
+        # keys S3 was too busy for come back in Errors, only those are sent again
+        busy = [error for error in response.get("Errors", []) if error.get("Code") in RETRY_CODES]
+        failed += [error for error in response.get("Errors", []) if error.get("Code") not in RETRY_CODES]
+        if not busy or attempt == attempts - 1:
+            return failed + busy
+        # each prefix S3 was busy for is throttled, not the batch's
+        for prefix in {rate_key(bucket_name, error["Key"]) for error in busy}:
+            SCHEDULER.throttled(prefix)
+        SCHEDULER.backoff(attempt)
+        busy_keys = {(error["Key"], error.get("VersionId")) for error in busy}
+        objects = [each for each in objects if (each["Key"], each.get("VersionId")) in busy_keys]
@@ -0,0 +1,94 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv, replace
+from pathlib import Path
+import gzip
+import shutil
+
+try:
+    # optional, pip install zstandard
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Content-Encoding values, https://www.iana.org/assignments/http-parameters/http-parameters.xhtml
+CODECS = ("gzip", "zstd")
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+# input compressed by one worker at a time
+BLOCK_BYTES = 8 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+# already compressed, another pass only costs CPU; "type/" matches the whole family
+INCOMPRESSIBLE_TYPES = getenv(
+    "incompressible_types",
+    "image/jpeg,image/png,image/gif,image/webp,video/,audio/,application/zip,application/gzip,"
+    "application/zstd,application/x-xz,application/x-bzip2,application/x-7z-compressed")
+METADATA_KEY = "uncompressed-size"
+
+
+def check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression '{codec}', use one of {', '.join(CODECS)}")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package: pip install zstandard")
+
+
+def is_compressible(content_type, incompressible_types=INCOMPRESSIBLE_TYPES) -> bool:
+    for each in incompressible_types.split(","):
+        each = each.strip()
+        if content_type == each or (each.endswith("/") and content_type.startswith(each)):
+            return False
+    return True
+
+
+def compress_block(data, codec, level=None) -> bytes:
+    # one gzip member / zstd frame; both formats decode concatenated ones as one stream.
+    # zlib and zstandard release the GIL, blocks really compress in parallel
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def compressed_chunks(stream, part_bytes, codec, level=None, concurrency=8, block_bytes=BLOCK_BYTES):
+    # yields exactly part_bytes long chunks of the compressed stream (the last one may
+    # be shorter) for upload_stream_parts; parts needn't end on a member boundary, and
+    # equal parts keep the multipart ETag checkable. At most `concurrency` blocks in flight
+    check_codec(codec)
+    part = bytearray()
+    read_any = False
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        in_flight = deque()
+        while True:
+            block = stream.read(block_bytes)
+            if block:
+                read_any = True
+                in_flight.append(executor.submit(compress_block, block, codec, level))
+            # results are taken in submission order, the output stays in input order
+            while in_flight and (len(in_flight) >= max(1, concurrency) or not block):
+                part += in_flight.popleft().result()
+                while len(part) >= part_bytes:
+                    yield bytes(part[:part_bytes])
+                    del part[:part_bytes]
+            if not block:
+                break
+    if not read_any:
+        # an empty body would not decode, an empty member does
+        part += compress_block(b"", codec, level)
+    yield bytes(part)
+
+
+def decompress_file(source, destination, codec):
+    # streams every member/frame into destination, replaced only when complete
+    check_codec(codec)
+    destination = Path(destination)
+    temporary = destination.with_name(destination.name + ".tmp")
+    with open(source, "rb") as f, open(temporary, "wb") as out:
+        if codec == "gzip":
+            with gzip.GzipFile(fileobj=f) as reader:
+                shutil.copyfileobj(reader, out, READ_CHUNK)
+        else:
+            with zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as reader:
+                shutil.copyfileobj(reader, out, READ_CHUNK)
+    replace(temporary, destination)
+    return destination
@@ -0,0 +1,46 @@
+from functools import lru_cache
+from os import getenv, stat
+from pathlib import Path
+import magic
+
+
+# libmagic decides on the first bytes, whole files and bodies are never read
+SNIFF_BYTES = 8 * 1024
+# "extension:mime type,..." shared by every upload path
+ALLOWED_TYPES = getenv("allowed_types", "jpeg:image/jpeg,png:image/png,mp4:video/mp4,txt:text/plain")
+
+
+def parse_allowed_types(allowed_types=ALLOWED_TYPES) -> dict:
+    # {mime type: extension}, so a lookup is one dict access
+    allowed = {}
+    for pair in allowed_types.split(","):
+        extension, mime_type = pair.strip().split(":", 1)
+        allowed[mime_type.strip()] = extension.strip()
+    return allowed
+
+
+ALLOWED = parse_allowed_types()
+
+
+def sniff_buffer(head) -> str:
+    return magic.from_buffer(bytes(head[:SNIFF_BYTES]), mime=True)
+
+
+@lru_cache(maxsize=65536)
+def _sniff_file(path, size, mtime) -> str:
+    # size and mtime are part of the cache key, a changed file is sniffed again
+    with open(path, "rb") as f:
+        return sniff_buffer(f.read(SNIFF_BYTES))
+
+
+def sniff_file(file_path) -> str:
+    file_stat = stat(file_path)
+    return _sniff_file(str(Path(file_path).resolve()), file_stat.st_size, file_stat.st_mtime)
+
+
+def allowed_type(mime_type, allowed=None) -> tuple:
+    # (content type, extension), ValueError for types outside the allow-list
+    extension = (allowed or ALLOWED).get(mime_type)
+    if not extension:
+        raise ValueError("Invalid type")
+    return mime_type, extension
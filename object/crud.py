@@ -1,19 +1,46 @@
+from itertools import chain
 from urllib.request import urlopen
-import io
-from hashlib import md5
-from time import localtime
 from os import getenv, stat
-import magic
 from pathlib import Path
+from botocore.exceptions import ClientError
+from aio import DEFAULT_LIMIT, results_of
+from bucket.index import indexed_entries
+from bucket.listing import iter_keys
+from object.multipart import DEFAULT_CONCURRENCY, choose_part_size, part_ranges, upload_file_parts, abort_upload, \
+    journal_path, new_journal, load_journal, save_journal, remove_journal, uploaded_parts, pending_ranges, \
+    read_parts, upload_stream_parts, server_side_copy
+from object.naming import render_key
+from object.content_type import SNIFF_BYTES, allowed_type, sniff_buffer, sniff_file
+from object.dedup import hash_file, content_file_name, find_duplicate, remember, METADATA_KEY
+from object.compression import check_codec, compressed_chunks, is_compressible, \
+    METADATA_KEY as UNCOMPRESSED_SIZE_KEY
+
+
+def get_objects(aws_s3_client, bucket_name, use_index=False) -> str:
+    if use_index:
+        keys = indexed_entries(aws_s3_client, bucket_name)
+    else:
+        keys = iter_keys(aws_s3_client, bucket_name)
+    for key in keys:
+        print(f" {key['Key']}, size: {key['Size']}")
 
 
-def get_objects(aws_s3_client, bucket_name) -> str:
-    for key in aws_s3_client.list_objects(Bucket=bucket_name)['Contents']:
-        print(f" {key['Key']}, size: {key['Size']}")
+def head_objects(aws_s3_client, bucket_name, keys, limit=DEFAULT_LIMIT) -> dict:
+    # {key: head_object response}, None for missing keys
+    def head(key):
+        try:
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/head_object.html
+            return aws_s3_client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
 
+    return results_of(head, keys, limit)
 
-def generate_file_name(file_extension) -> str:
-    return f'up_{md5(str(localtime()).encode("utf-8")).hexdigest()}.{file_extension}'
+
+def generate_file_name(file_extension, template=None) -> str:
+    return render_key(file_extension, template)
 
 
 '''
@@ -24,40 +51,51 @@ object new-bucket-btu-7 -ol "https://img.lovepik.com/element/45012/9839.png_300.
 '''
 
 
-def download_file_and_upload_to_s3(aws_s3_client, bucket_name, url, s3_region=None, keep_local=True) -> str:
+def download_file_and_upload_to_s3(aws_s3_client, bucket_name, url, s3_region=None, keep_local=True,
+                                   part_size=None, concurrency=DEFAULT_CONCURRENCY, key_template=None) -> str:
     (s3_region := getenv("aws_s3_region_name", "us-west-2"))
 
-    allowed_types = {
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "mp4": "video/mp4"
-    }
-
     with urlopen(url) as response:
-        content = response.read()
-        mime_type = magic.from_buffer(content, mime=True)
-        content_type = None
-        file_name = None
-
-        for type, ctype in allowed_types.items():
-            if mime_type == ctype:
-                content_type = ctype
-                file_name = generate_file_name(type)
-
-        if not content_type:
-            raise ValueError("Invalid type")
-
-        aws_s3_client.upload_fileobj(
-            Fileobj=io.BytesIO(content),
-            Bucket=bucket_name,
-            ExtraArgs={'ContentType': content_type},
-            Key=file_name
+        # magic only needs the first bytes, the rest is streamed straight to S3
+        head = response.read(SNIFF_BYTES)
+        content_type, extension = allowed_type(sniff_buffer(head))
+        file_name = generate_file_name(extension, key_template)
+
+        total_bytes = int(response.headers.get("Content-Length") or 0)
+        part_bytes = choose_part_size(total_bytes, part_size)
+        # without a length the part size can't be fitted up front, it grows along the way
+        grow = not total_bytes
+        # the local copy is written while streaming, not after the upload; it is opened
+        # first, a file that can't be written leaves no upload behind
+        local_path = Path(f"static/{file_name}")
+        if keep_local:
+            # templates like {hash}/{date}/{id}.{ext} put the copy in folders
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+        local_file = open(local_path, mode="wb") if keep_local else None
+        try:
+            mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=file_name, ContentType=content_type)
+        except BaseException:
+            if local_file:
+                local_file.close()
+            raise
+        mpu_id = mpu["UploadId"]
+
+        try:
+            parts = upload_stream_parts(
+                aws_s3_client, bucket_name, file_name, mpu_id,
+                read_parts(response, part_bytes, head, grow), concurrency,
+                local_file.write if local_file else None)
+        except BaseException:
+            abort_upload(aws_s3_client, bucket_name, file_name, mpu_id)
+            raise
+        finally:
+            if local_file:
+                local_file.close()
+
+        aws_s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=file_name, UploadId=mpu_id, MultipartUpload={"Parts": parts}
         )
 
-    if keep_local:
-        with open(Path(f"static/{file_name}"), mode="wb") as file:
-            file.write(content)
-
     # public URL
     return "https://s3-{0}.amazonaws.com/{1}/{2}".format(
         s3_region,
@@ -66,33 +104,115 @@ def download_file_and_upload_to_s3(aws_s3_client, bucket_name, url, s3_region=No
     )
 
 
-def multipart_upload(aws_s3_client, bucket_name, file_path, file_name, content_type):
+def multipart_upload(aws_s3_client, bucket_name, file_path, file_name, content_type,
+                     part_size=None, concurrency=DEFAULT_CONCURRENCY, resume=False, metadata=None) -> str:
 
-    # https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
-    PART_BYTES = 5 * 1024 * 1024
-    mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=file_name, ContentType=content_type)
-    mpu_id = mpu["UploadId"]
-
-    parts = []
-    uploaded_bytes = 0
     total_bytes = stat(file_path).st_size
-    with open(file_path, "rb") as f:
-        i = 1
-        while True:
-            data = f.read(PART_BYTES)
-            if not len(data):
-                break
-            part = aws_s3_client.upload_part(
-                Body=data, Bucket=bucket_name, Key=file_name, UploadId=mpu_id, PartNumber=i)
-            parts.append({"PartNumber": i, "ETag": part["ETag"]})
-            uploaded_bytes += len(data)
-            print("{0} of {1} uploaded".format(uploaded_bytes, total_bytes))
-            i += 1
+    journal_file = journal_path(bucket_name, file_path)
+    journal = load_journal(journal_file, file_path) if resume else None
+    remote_parts = None
+
+    if journal:
+        try:
+            remote_parts = uploaded_parts(aws_s3_client, bucket_name, journal["key"], journal["upload_id"])
+        except ClientError as error:
+            # upload was aborted or completed meanwhile, start over
+            if error.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            journal = None
+
+    if journal:
+        file_name = journal["key"]
+        mpu_id = journal["upload_id"]
+        part_bytes = journal["part_bytes"]
+        ranges = part_ranges(total_bytes, part_bytes)
+        pending = pending_ranges(journal, ranges, remote_parts)
+        print("Resuming upload {0}, {1} of {2} parts left".format(mpu_id, len(pending), len(ranges)))
+    else:
+        part_bytes = choose_part_size(total_bytes, part_size)
+        mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=file_name, ContentType=content_type,
+                                                    Metadata=metadata or {})
+        mpu_id = mpu["UploadId"]
+        pending = ranges = part_ranges(total_bytes, part_bytes)
+        journal = new_journal(bucket_name, file_name, mpu_id, file_path, part_bytes)
+
+    on_part = None
+    if resume:
+        save_journal(journal_file, journal)
+        offsets = {part_number: (offset, length) for part_number, offset, length in ranges}
+
+        def journal_part(part):
+            offset, length = offsets[part["PartNumber"]]
+            journal["parts"][str(part["PartNumber"])] = {"ETag": part["ETag"], "offset": offset, "length": length}
+            save_journal(journal_file, journal)
+
+        on_part = journal_part
+
+    try:
+        parts = upload_file_parts(
+            aws_s3_client, bucket_name, file_name, mpu_id, file_path,
+            pending, concurrency, on_part)
+    except BaseException:
+        # don't leave orphaned parts behind, they are billed as storage,
+        # unless the journal lets the next run pick them up
+        if not resume:
+            abort_upload(aws_s3_client, bucket_name, file_name, mpu_id)
+        raise
+
+    if resume:
+        # parts finished by earlier runs are only known from the journal
+        parts = [{"PartNumber": int(number), "ETag": part["ETag"]} for number, part in journal["parts"].items()]
+        parts.sort(key=lambda part: part["PartNumber"])
 
     result = aws_s3_client.complete_multipart_upload(
         Bucket=bucket_name, Key=file_name, UploadId=mpu_id, MultipartUpload={"Parts": parts}
     )
+    if resume:
+        remove_journal(journal_file)
     print(result)
+    return file_name
+
+
+def upload_compressed(aws_s3_client, bucket_name, file_path, file_name, content_type, codec, level=None,
+                      part_size=None, concurrency=DEFAULT_CONCURRENCY, metadata=None) -> str:
+    total_bytes = stat(file_path).st_size
+    # compressed parts are packed to at least the part size, only the last may be smaller
+    part_bytes = choose_part_size(total_bytes, part_size)
+    extra_args = {
+        "ContentType": content_type,
+        # browsers and HTTP clients decode it on the fly
+        "ContentEncoding": codec,
+        "Metadata": {**(metadata or {}), UNCOMPRESSED_SIZE_KEY: str(total_bytes)}
+    }
+    compressed = {"bytes": 0}
+
+    def counted(chunks):
+        for chunk in chunks:
+            compressed["bytes"] += len(chunk)
+            yield chunk
+
+    with open(file_path, "rb") as f:
+        chunks = counted(compressed_chunks(f, part_bytes, codec, level, concurrency))
+        first, second = next(chunks), next(chunks, None)
+        if not second:
+            # fits in one part, one request instead of three
+            aws_s3_client.put_object(Body=first, Bucket=bucket_name, Key=file_name, **extra_args)
+        else:
+            mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=file_name, **extra_args)
+            mpu_id = mpu["UploadId"]
+            try:
+                parts = upload_stream_parts(aws_s3_client, bucket_name, file_name, mpu_id,
+                                            chain([first, second], chunks), concurrency)
+            except BaseException:
+                abort_upload(aws_s3_client, bucket_name, file_name, mpu_id)
+                raise
+            aws_s3_client.complete_multipart_upload(
+                Bucket=bucket_name, Key=file_name, UploadId=mpu_id, MultipartUpload={"Parts": parts}
+            )
+
+    print("{0}: {1} bytes, {2} compressed with {3} ({4:.1f}x)".format(
+        file_name, total_bytes, compressed["bytes"], codec, total_bytes / max(compressed["bytes"], 1)))
+    return file_name
 
 
 '''
@@ -101,18 +221,23 @@ object new-bucket-btu-7 -loc_o hello.txt -u_t upload_fileobj
 object new-bucket-btu-7 -loc_o hello.txt -u_t upload_fileobj
 '''
 
-def upload_local_file_to_folder(aws_s3_client, bucket_name, file_name, folder_name):
+def upload_local_file_to_folder(aws_s3_client, bucket_name, file_name, folder_name, compress=None,
+                                compress_level=None):
     (s3_region := getenv("aws_s3_region_name", "us-west-2"))
 
     file_path = Path(f"static/{file_name}")
-    mime_type = magic.from_file(file_path, mime=True)
+    mime_type, _ = allowed_type(sniff_file(file_path))
 
-    aws_s3_client.upload_file(
-            file_path,
-            bucket_name,
-            f"{folder_name}/{file_name}",
-            ExtraArgs={'ContentType': mime_type}
-        )
+    if compress and is_compressible(mime_type):
+        upload_compressed(aws_s3_client, bucket_name, file_path, f"{folder_name}/{file_name}", mime_type,
+                          compress, compress_level)
+    else:
+        aws_s3_client.upload_file(
+                file_path,
+                bucket_name,
+                f"{folder_name}/{file_name}",
+                ExtraArgs={'ContentType': mime_type}
+            )
 
     return "https://s3-{0}.amazonaws.com/{1}/{2}/{3}".format(
         s3_region,
@@ -122,35 +247,48 @@ def upload_local_file_to_folder(aws_s3_client, bucket_name, file_name, folder_na
     )
 
 
-def upload_local_file(aws_s3_client, bucket_name, filename, keep_file_name, upload_type="upload_file"):
+def upload_local_file(aws_s3_client, bucket_name, filename, keep_file_name, upload_type="upload_file",
+                      part_size=None, concurrency=DEFAULT_CONCURRENCY, resume=False, dedup=False, key_template=None,
+                      compress=None, compress_level=None):
     (s3_region := getenv("aws_s3_region_name", "us-west-2"))
 
-    allowed_types = {
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "mp4": "video/mp4",
-        "txt": "text/plain"
-    }
-
     file_path = Path(f"static/{filename}")
-    mime_type = magic.from_file(file_path, mime=True)
-    content_type = None
-    file_name = None
-
-    for type, ctype in allowed_types.items():
-        if mime_type == ctype:
-            content_type = ctype
-            file_name = filename if keep_file_name else generate_file_name(type)
-
-    if not content_type:
-        raise ValueError("Invalid type")
-
-    if upload_type == "upload_file":
+    content_type, extension = allowed_type(sniff_file(file_path))
+    if compress:
+        check_codec(compress)
+        # mp4, png, ... are already compressed and go up as they are
+        compress = compress if is_compressible(content_type) else None
+    if compress and resume:
+        raise ValueError("--resume can't be combined with --compress, compressed parts aren't journaled")
+    file_name = filename if keep_file_name else generate_file_name(extension, key_template)
+
+    extra_args = {'ContentType': content_type}
+    if dedup:
+        digest = hash_file(file_path)
+        if not keep_file_name:
+            file_name = content_file_name(digest, extension)
+        extra_args['Metadata'] = {METADATA_KEY: digest}
+        duplicate = find_duplicate(aws_s3_client, bucket_name, digest, file_name)
+        if duplicate == file_name:
+            print(f"{file_name} already holds this content, upload skipped")
+            upload_type = None
+        elif duplicate:
+            # same bytes under another key, S3 copies them without our bandwidth
+            server_side_copy(aws_s3_client, {'Bucket': bucket_name, 'Key': duplicate}, bucket_name, file_name,
+                             stat(file_path).st_size, concurrency)
+            print(f"{file_name} copied from {duplicate}, upload skipped")
+            upload_type = None
+
+    if upload_type and compress:
+        # every upload type streams through the same compressing multipart path
+        upload_compressed(aws_s3_client, bucket_name, file_path, file_name, content_type, compress,
+                          compress_level, part_size, concurrency, extra_args.get('Metadata'))
+    elif upload_type == "upload_file":
         aws_s3_client.upload_file(
             file_path,
             bucket_name,
             file_name,
-            ExtraArgs={'ContentType': content_type}
+            ExtraArgs=extra_args
         )
     elif upload_type == "upload_fileobj":
         with open(file_path, "rb") as file:
@@ -158,7 +296,7 @@ def upload_local_file(aws_s3_client, bucket_name, filename, keep_file_name, uplo
                 file,
                 bucket_name,
                 file_name,
-                ExtraArgs={'ContentType': content_type}
+                ExtraArgs=extra_args
             )
     elif upload_type == "put_object":
         with open(file_path, "rb") as file:
@@ -166,17 +304,24 @@ def upload_local_file(aws_s3_client, bucket_name, filename, keep_file_name, uplo
                 Body=file.read(),
                 Bucket=bucket_name,
                 Key=file_name,
-                ExtraArgs={'ContentType': content_type}
+                **extra_args
             )
     elif upload_type == "multipart_upload":
-        multipart_upload(
+        file_name = multipart_upload(
             aws_s3_client,
             bucket_name,
             file_path,
             file_name,
-            content_type
+            content_type,
+            part_size,
+            concurrency,
+            resume,
+            extra_args.get('Metadata')
         )
 
+    if dedup:
+        remember(bucket_name, file_name, digest, stat(file_path).st_size)
+
     # public URL
     return "https://s3-{0}.amazonaws.com/{1}/{2}".format(
         s3_region,
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+from hashlib import sha256
+from os import getenv, stat
+from pathlib import Path
+import sqlite3
+from botocore.exceptions import ClientError
+
+
+CACHE_PATH = Path(getenv("dedup_cache_path", ".dedup/cache.sqlite3"))
+# least recently used entries are dropped past this many
+CACHE_ENTRIES = int(getenv("dedup_cache_entries", 100000))
+HASH_CHUNK = 1024 * 1024
+METADATA_KEY = "sha256"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used TEXT NOT NULL,
+    PRIMARY KEY (sha256, bucket)
+);
+CREATE INDEX IF NOT EXISTS contents_last_used ON contents (last_used);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def connect(path=CACHE_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def hash_file(file_path, connection=None) -> str:
+    # streamed in 1 MiB chunks, unchanged files (same size and mtime) aren't read again
+    connection = connection or connect()
+    file_stat = stat(file_path)
+    path = str(Path(file_path).resolve())
+    row = connection.execute("SELECT size, mtime, sha256 FROM files WHERE path = ?", (path,)).fetchone()
+    if row and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime:
+        return row[2]
+
+    digest = sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                           (path, file_stat.st_size, file_stat.st_mtime, digest.hexdigest()))
+    return digest.hexdigest()
+
+
+def content_file_name(digest, file_extension) -> str:
+    # same content, same key
+    return f"up_{digest}.{file_extension}"
+
+
+def remember(bucket_name, file_name, digest, size, connection=None):
+    connection = connection or connect()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO contents VALUES (?, ?, ?, ?, ?)",
+                           (digest, bucket_name, file_name, size, datetime.now(timezone.utc).isoformat()))
+        connection.execute(
+            "DELETE FROM contents WHERE rowid IN "
+            "(SELECT rowid FROM contents ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (CACHE_ENTRIES,))
+
+
+def _stored_digest(aws_s3_client, bucket_name, file_name):
+    try:
+        head = aws_s3_client.head_object(Bucket=bucket_name, Key=file_name)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return head.get("Metadata", {}).get(METADATA_KEY)
+
+
+def find_duplicate(aws_s3_client, bucket_name, digest, file_name, connection=None):
+    # key in the bucket that already holds this content, or None; the target key
+    # itself is checked first, then whatever the cache last saw it under
+    connection = connection or connect()
+    if _stored_digest(aws_s3_client, bucket_name, file_name) == digest:
+        return file_name
+
+    row = connection.execute("SELECT key FROM contents WHERE sha256 = ? AND bucket = ?",
+                             (digest, bucket_name)).fetchone()
+    if not row:
+        return None
+    # the object may have been overwritten or deleted since
+    if _stored_digest(aws_s3_client, bucket_name, row[0]) == digest:
+        with connection:
+            connection.execute("UPDATE contents SET last_used = ? WHERE sha256 = ? AND bucket = ?",
+                               (datetime.now(timezone.utc).isoformat(), digest, bucket_name))
+        return row[0]
+    with connection:
+        connection.execute("DELETE FROM contents WHERE sha256 = ? AND bucket = ?", (digest, bucket_name))
+    return None
@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from hashlib import md5
+from os import stat
+from pathlib import Path
+from threading import Lock
+import json
+import mmap
+from metrics import Progress
+from object.compression import CODECS, decompress_file
+from object.multipart import DEFAULT_CONCURRENCY, choose_part_size, part_ranges, save_journal, remove_journal
+
+
+READ_CHUNK = 1024 * 1024
+
+
+def _version_args(version_id) -> dict:
+    return {"VersionId": version_id} if version_id else {}
+
+
+def _load_journal(path, head):
+    try:
+        with open(path) as f:
+            journal = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # the object changed since, the downloaded ranges are useless
+    if journal["etag"] != head["ETag"] or journal["size"] != head["ContentLength"]:
+        return None
+    return journal
+
+
+def _download_range(aws_s3_client, bucket_name, file_name, version_id, etag, buffer, offset, length):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/get_object.html
+    response = aws_s3_client.get_object(
+        Bucket=bucket_name, Key=file_name, Range=f"bytes={offset}-{offset + length - 1}",
+        # fails instead of mixing ranges of two different objects
+        IfMatch=etag, **_version_args(version_id))
+    body = response["Body"]
+    position = offset
+    while chunk := body.read(READ_CHUNK):
+        buffer[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    if position != offset + length:
+        raise IOError(f"range {offset}-{offset + length - 1} of {file_name} came back short")
+
+
+def _part_sizes(aws_s3_client, bucket_name, file_name, version_id, count, concurrency=DEFAULT_CONCURRENCY) -> list:
+    # every part's length, HEAD with PartNumber answers with that part's ContentLength
+    def size(part_number):
+        return aws_s3_client.head_object(Bucket=bucket_name, Key=file_name, PartNumber=part_number,
+                                         **_version_args(version_id))["ContentLength"]
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(size, range(1, count + 1)))
+
+
+def _md5_parts(path, lengths) -> list:
+    # MD5 of every consecutive slice of the file with the given lengths
+    digests = []
+    with open(path, "rb") as f:
+        for length in lengths:
+            digest, left = md5(), length
+            while left and (chunk := f.read(min(READ_CHUNK, left))):
+                digest.update(chunk)
+                left -= len(chunk)
+            digests.append(digest)
+    return digests
+
+
+def _multipart_etag(path, lengths) -> str:
+    digests = _md5_parts(path, lengths)
+    return "{0}-{1}".format(md5(b"".join(digest.digest() for digest in digests)).hexdigest(), len(digests))
+
+
+def expected_etag(aws_s3_client, bucket_name, file_name, version_id, etag, path, concurrency=DEFAULT_CONCURRENCY):
+    # single part ETag is the MD5 of the object, a multipart one ("...-N") the
+    # MD5 of the parts' MD5s. Parts are mostly all as long as part 1, that is
+    # tried first; otherwise (streamed uploads, copies) every part's length is read back
+    # https://docs.aws.amazon.com/AmazonS3/latest/userguide/checking-object-integrity.html
+    size = stat(path).st_size
+    if "-" not in etag:
+        return _md5_parts(path, [size])[0].hexdigest()
+
+    count = int(etag.rsplit("-", 1)[1])
+    first = aws_s3_client.head_object(
+        Bucket=bucket_name, Key=file_name, PartNumber=1, **_version_args(version_id))["ContentLength"]
+    last = size - first * (count - 1)
+    if 0 < last <= first or count == 1:
+        actual = _multipart_etag(path, [first] * (count - 1) + [last])
+        if actual == etag:
+            return actual
+    return _multipart_etag(path, _part_sizes(aws_s3_client, bucket_name, file_name, version_id, count, concurrency))
+
+
+def download_object(aws_s3_client, bucket_name, file_name, output=None, version_id=None, part_size=None,
+                    concurrency=DEFAULT_CONCURRENCY, verify=True, decompress=True) -> Path:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/head_object.html
+    head = aws_s3_client.head_object(Bucket=bucket_name, Key=file_name, **_version_args(version_id))
+    size = head["ContentLength"]
+    output = Path(output or f"static/{Path(file_name).name}")
+    partial = output.with_name(output.name + ".part")
+    journal_file = output.with_name(output.name + ".download.json")
+
+    part_bytes = choose_part_size(size, part_size)
+    journal = _load_journal(journal_file, head) if partial.exists() else None
+    if not journal:
+        journal = {"etag": head["ETag"], "size": size, "part_bytes": part_bytes, "done": []}
+        output.parent.mkdir(parents=True, exist_ok=True)
+        # preallocated, every range is written straight to its place
+        with open(partial, "wb") as f:
+            f.truncate(size)
+    else:
+        print("Resuming download, {0} parts already done".format(len(journal["done"])))
+    all_ranges = part_ranges(size, journal["part_bytes"])
+    ranges = [each for each in all_ranges if each[0] not in journal["done"]]
+
+    progress = Progress(sum(length for _, _, length in ranges), file_name)
+    lock = Lock()
+
+    def done(future, part_number, length):
+        if future.cancelled() or future.exception():
+            return
+        progress.update(length)
+        with lock:
+            journal["done"].append(part_number)
+            save_journal(journal_file, journal)
+
+    if size and ranges:
+        with open(partial, "r+b") as f, mmap.mmap(f.fileno(), size) as buffer:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                futures = []
+                for part_number, offset, length in ranges:
+                    future = executor.submit(_download_range, aws_s3_client, bucket_name, file_name, version_id,
+                                             head["ETag"], buffer, offset, length)
+                    future.add_done_callback(lambda f, n=part_number, length=length: done(f, n, length))
+                    futures.append(future)
+
+                finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    if future.exception():
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        buffer.flush()
+                        raise future.exception()
+            buffer.flush()
+
+    # SSE-KMS ETags are not an MD5 of the content
+    etag = head["ETag"].strip('"')
+    if verify and head.get("ServerSideEncryption") != "aws:kms":
+        actual = expected_etag(aws_s3_client, bucket_name, file_name, version_id, etag, partial, concurrency)
+        if actual != etag:
+            # the bytes stay for a look, the next run downloads from scratch
+            remove_journal(journal_file)
+            raise ValueError(f"Checksum mismatch for {file_name}: expected {etag}, got {actual}; "
+                             f"the download is kept as {partial}")
+
+    # the ETag covers the stored (compressed) bytes, so decode only after the check
+    if decompress and head.get("ContentEncoding") in CODECS:
+        decompress_file(partial, output, head["ContentEncoding"])
+        partial.unlink()
+    else:
+        partial.replace(output)
+    remove_journal(journal_file)
+    return output
@@ -0,0 +1,304 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from threading import Lock, BoundedSemaphore
+from os import getenv, replace, stat
+from hashlib import md5
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import json
+from aio import SCHEDULER, rate_key
+from metrics import Progress
+
+
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MIN_PART_BYTES = 5 * 1024 * 1024
+MAX_PART_BYTES = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+# streams of unknown length double their part size every this many parts,
+# 10,000 parts then reach past the 5 TiB object limit from 5 MiB parts
+GROW_EVERY_PARTS = 900
+# https://docs.aws.amazon.com/AmazonS3/latest/API/API_CopyObject.html
+MAX_COPY_BYTES = 5 * 1024 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+# headers a multipart copy has to set again, copy_object keeps them by itself
+COPIED_HEADERS = ("CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage", "Expires",
+                  "StorageClass", "WebsiteRedirectLocation")
+# incomplete uploads this many days old are taken as abandoned
+ABORT_AFTER_DAYS = 1
+JOURNAL_DIR = Path(getenv("multipart_journal_dir", ".multipart"))
+
+
+def choose_part_size(total_bytes, part_bytes=None) -> int:
+    part_bytes = max(part_bytes or MIN_PART_BYTES, MIN_PART_BYTES)
+    # grow the part until the whole file fits in 10,000 parts
+    while part_bytes * MAX_PARTS < total_bytes:
+        part_bytes *= 2
+    return min(part_bytes, MAX_PART_BYTES)
+
+
+def part_ranges(total_bytes, part_bytes) -> list:
+    # [(part_number, offset, length), ...], S3 part numbers start at 1
+    ranges = []
+    for i, offset in enumerate(range(0, total_bytes, part_bytes), start=1):
+        ranges.append((i, offset, min(part_bytes, total_bytes - offset)))
+    return ranges or [(1, 0, 0)]
+
+
+def _upload_part_bytes(aws_s3_client, bucket_name, file_name, mpu_id, part_number, data):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/upload_part.html
+    part = SCHEDULER.call(rate_key(bucket_name, file_name), aws_s3_client.upload_part,
+                          Body=data, Bucket=bucket_name, Key=file_name, UploadId=mpu_id, PartNumber=part_number)
+    return {"PartNumber": part_number, "ETag": part["ETag"]}
+
+
+def _upload_part(aws_s3_client, bucket_name, file_name, mpu_id, file_path, part_number, offset, length):
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return _upload_part_bytes(aws_s3_client, bucket_name, file_name, mpu_id, part_number, data)
+
+
+def upload_file_parts(aws_s3_client, bucket_name, file_name, mpu_id, file_path, ranges,
+                      concurrency=DEFAULT_CONCURRENCY, on_part=None) -> list:
+    # resumed uploads only count the parts still to send
+    progress = Progress(sum(length for _, _, length in ranges), file_name)
+    lock = Lock()
+    parts = []
+
+    def done(future, length):
+        if future.cancelled() or future.exception():
+            return
+        progress.update(length)
+        with lock:
+            parts.append(future.result())
+            if on_part:
+                on_part(future.result())
+
+    # every worker reads its own range, so at most `concurrency` parts are in memory
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = []
+        for part_number, offset, length in ranges:
+            future = executor.submit(
+                _upload_part, aws_s3_client, bucket_name, file_name, mpu_id,
+                file_path, part_number, offset, length)
+            future.add_done_callback(lambda f, length=length: done(f, length))
+            futures.append(future)
+
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in finished:
+            if future.exception():
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise future.exception()
+
+    return sorted(parts, key=lambda part: part["PartNumber"])
+
+
+def growing_part_size(part_number, part_bytes) -> int:
+    return min(part_bytes * 2 ** ((part_number - 1) // GROW_EVERY_PARTS), MAX_PART_BYTES)
+
+
+def read_parts(stream, part_bytes, head=b"", grow=False):
+    # yields part_bytes sized chunks of a stream whose length may be unknown,
+    # `head` is what was already read from it (e.g. to sniff the type). With
+    # grow, parts get bigger as they add up, see GROW_EVERY_PARTS
+    part = bytearray(head)
+    part_number = 1
+    while True:
+        size = growing_part_size(part_number, part_bytes) if grow else part_bytes
+        data = stream.read(size - len(part))
+        if not data:
+            break
+        part += data
+        if len(part) >= size:
+            yield bytes(part)
+            part = bytearray()
+            part_number += 1
+    yield bytes(part)
+
+
+def upload_stream_parts(aws_s3_client, bucket_name, file_name, mpu_id, chunks,
+                        concurrency=DEFAULT_CONCURRENCY, on_chunk=None) -> list:
+    progress = Progress(label=file_name)
+    lock = Lock()
+    # the reader blocks once `concurrency` parts are in flight, memory stays flat
+    slots = BoundedSemaphore(max(1, concurrency))
+    errors = []
+    parts = []
+
+    def done(future, length):
+        slots.release()
+        if future.exception():
+            errors.append(future.exception())
+            return
+        progress.update(length)
+        with lock:
+            parts.append(future.result())
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for part_number, data in enumerate(chunks, start=1):
+            # the trailing empty chunk only matters for an empty stream
+            if not data and part_number > 1:
+                break
+            if on_chunk:
+                on_chunk(data)
+            slots.acquire()
+            if errors:
+                break
+            future = executor.submit(
+                _upload_part_bytes, aws_s3_client, bucket_name, file_name, mpu_id, part_number, data)
+            future.add_done_callback(lambda f, length=len(data): done(f, length))
+    progress.close()
+
+    if errors:
+        raise errors[0]
+    return sorted(parts, key=lambda part: part["PartNumber"])
+
+
+def _copy_part(aws_s3_client, bucket_name, file_name, mpu_id, copy_source, part_number, offset, length):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/upload_part_copy.html
+    part = SCHEDULER.call(rate_key(bucket_name, file_name), aws_s3_client.upload_part_copy,
+                          Bucket=bucket_name, Key=file_name, UploadId=mpu_id, PartNumber=part_number,
+                          CopySource=copy_source, CopySourceRange=f"bytes={offset}-{offset + length - 1}")
+    return {"PartNumber": part_number, "ETag": part["CopyPartResult"]["ETag"]}
+
+
+def _source_part_bytes(aws_s3_client, copy_source, head):
+    # a multipart source is copied with its own part size, so the copy gets the
+    # same ETag and can be checked against the source without reading it
+    if "-" not in head["ETag"]:
+        return None
+    return aws_s3_client.head_object(
+        Bucket=copy_source["Bucket"], Key=copy_source["Key"], PartNumber=1,
+        **({"VersionId": copy_source["VersionId"]} if "VersionId" in copy_source else {}))["ContentLength"]
+
+
+def copy_large_object(aws_s3_client, copy_source, bucket_name, file_name, size=None,
+                      concurrency=DEFAULT_CONCURRENCY, extra_args=None):
+    # copy_object stops at 5 GB, bigger objects are copied part by part on the server
+    head = aws_s3_client.head_object(Bucket=copy_source["Bucket"], Key=copy_source["Key"],
+                                     **({"VersionId": copy_source["VersionId"]} if "VersionId" in copy_source else {}))
+    size = head["ContentLength"] if size is None else size
+    # unlike copy_object, a multipart upload doesn't carry the source metadata over
+    extra_args = extra_args or {"ContentType": head.get("ContentType", "binary/octet-stream"),
+                                "Metadata": head.get("Metadata", {}),
+                                **{name: head[name] for name in COPIED_HEADERS if head.get(name)}}
+    part_bytes = _source_part_bytes(aws_s3_client, copy_source, head) or choose_part_size(size, 256 * 1024 * 1024)
+    mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=file_name, **extra_args)
+    mpu_id = mpu["UploadId"]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [executor.submit(_copy_part, aws_s3_client, bucket_name, file_name, mpu_id,
+                                       copy_source, part_number, offset, length)
+                       for part_number, offset, length in part_ranges(size, part_bytes)]
+            parts = [future.result() for future in futures]
+    except BaseException:
+        abort_upload(aws_s3_client, bucket_name, file_name, mpu_id)
+        raise
+
+    return aws_s3_client.complete_multipart_upload(
+        Bucket=bucket_name, Key=file_name, UploadId=mpu_id, MultipartUpload={"Parts": parts}
+    )
+
+
+def server_side_copy(aws_s3_client, copy_source, bucket_name, file_name, size,
+                     concurrency=DEFAULT_CONCURRENCY, extra_args=None):
+    if size > MAX_COPY_BYTES:
+        return copy_large_object(aws_s3_client, copy_source, bucket_name, file_name, size, concurrency, extra_args)
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/copy_object.html
+    return SCHEDULER.call(rate_key(bucket_name, file_name), aws_s3_client.copy_object,
+                          Bucket=bucket_name, Key=file_name, CopySource=copy_source, **(extra_args or {}))
+
+
+def abort_upload(aws_s3_client, bucket_name, file_name, mpu_id):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/abort_multipart_upload.html
+    aws_s3_client.abort_multipart_upload(Bucket=bucket_name, Key=file_name, UploadId=mpu_id)
+
+
+def journal_path(bucket_name, file_path) -> Path:
+    # one journal per (bucket, local file), the key may be a generated name
+    digest = md5(f"{bucket_name}/{Path(file_path).resolve()}".encode("utf-8")).hexdigest()
+    return JOURNAL_DIR / f"{digest}.json"
+
+
+def new_journal(bucket_name, file_name, mpu_id, file_path, part_bytes) -> dict:
+    file_stat = stat(file_path)
+    return {
+        "bucket": bucket_name,
+        "key": file_name,
+        "upload_id": mpu_id,
+        "file_path": str(file_path),
+        "size": file_stat.st_size,
+        "mtime": file_stat.st_mtime,
+        "part_bytes": part_bytes,
+        "parts": {}
+    }
+
+
+def load_journal(path, file_path):
+    try:
+        with open(path) as f:
+            journal = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    # the local file changed since the journal was written, its parts are useless
+    file_stat = stat(file_path)
+    if journal["size"] != file_stat.st_size or journal["mtime"] != file_stat.st_mtime:
+        return None
+    return journal
+
+
+def save_journal(path, journal):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(journal, f)
+    # atomic, a crash mid-write never leaves a truncated journal
+    replace(tmp_path, path)
+
+
+def remove_journal(path):
+    path.unlink(missing_ok=True)
+
+
+def uploaded_parts(aws_s3_client, bucket_name, file_name, mpu_id) -> dict:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListParts.html
+    parts = {}
+    paginator = aws_s3_client.get_paginator("list_parts")
+    for page in paginator.paginate(Bucket=bucket_name, Key=file_name, UploadId=mpu_id):
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = {"ETag": part["ETag"], "Size": part["Size"]}
+    return parts
+
+
+def pending_ranges(journal, ranges, remote_parts) -> list:
+    # a part is done only if S3 still has it with the ETag and size we recorded
+    pending = []
+    for part_number, offset, length in ranges:
+        local = journal["parts"].get(str(part_number))
+        remote = remote_parts.get(part_number)
+        if local and remote and local["ETag"] == remote["ETag"] and remote["Size"] == length:
+            continue
+        journal["parts"].pop(str(part_number), None)
+        pending.append((part_number, offset, length))
+    return pending
+
+
+def list_incomplete_uploads(aws_s3_client, bucket_name, older_than_days=0) -> list:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/paginator/ListMultipartUploads.html
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    uploads = []
+    paginator = aws_s3_client.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for upload in page.get("Uploads", []):
+            if upload["Initiated"] <= cutoff:
+                uploads.append(upload)
+    return uploads
+
+
+def abort_incomplete_uploads(aws_s3_client, bucket_name, older_than_days=ABORT_AFTER_DAYS) -> list:
+    # uploads younger than that may still be running, aborting them breaks the upload
+    uploads = list_incomplete_uploads(aws_s3_client, bucket_name, older_than_days)
+    for upload in uploads:
+        abort_upload(aws_s3_client, bucket_name, upload["Key"], upload["UploadId"])
+    return uploads
@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from hashlib import md5
+from os import getenv, urandom
+from threading import Lock
+from time import localtime, time_ns
+
+
+# https://github.com/ulid/spec
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# every 10 bit value as two chars, an id is 13 lookups
+PAIRS = [a + b for a in CROCKFORD for b in CROCKFORD]
+SHIFTS = range(120, -1, -10)
+# {id}: time ordered unique id, {hash}: 2 hex chars of the id's md5 to spread
+# keys over S3 partitions, {date}: YYYY/MM/DD, {ext}: file extension.
+# "legacy" is the old md5(localtime()) name, unique per second only
+KEY_TEMPLATE = getenv("key_template", "up_{id}.{ext}")
+
+_lock = Lock()
+_last = {"ms": 0, "random": 0}
+
+
+def _encode(value) -> str:
+    # 26 Crockford base32 chars of a 128 bit value
+    return "".join([PAIRS[(value >> shift) & 1023] for shift in SHIFTS])
+
+
+def time_ordered_id() -> str:
+    # ULID: 48 bit millisecond timestamp + 80 random bits. Inside the same
+    # millisecond the random part is incremented, so ids from one process
+    # never repeat and still sort in creation order
+    with _lock:
+        ms = time_ns() // 1_000_000
+        if ms <= _last["ms"]:
+            ms = _last["ms"]
+            _last["random"] = (_last["random"] + 1) % (1 << 80)
+        else:
+            _last["random"] = int.from_bytes(urandom(10), "big")
+        _last["ms"] = ms
+        value = (ms << 80) | _last["random"]
+    return _encode(value)
+
+
+def legacy_file_name(file_extension) -> str:
+    return f'up_{md5(str(localtime()).encode("utf-8")).hexdigest()}.{file_extension}'
+
+
+def render_key(file_extension, template=None) -> str:
+    template = template or KEY_TEMPLATE
+    if template == "legacy":
+        return legacy_file_name(file_extension)
+
+    unique_id = time_ordered_id()
+    return template.format(
+        id=unique_id,
+        hash=md5(unique_id.encode("utf-8")).hexdigest()[:2],
+        date=datetime.now(timezone.utc).strftime("%Y/%m/%d"),
+        ext=file_extension
+    )
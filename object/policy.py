@@ -1,3 +1,5 @@
+from aio import DEFAULT_LIMIT, SCHEDULER, RateLimiter, rate_key, run_bounded
+from bucket.listing import iter_keys
 
 
 def set_object_access_policy(aws_s3_client, bucket_name, file_name):
@@ -10,3 +12,44 @@ def set_object_access_policy(aws_s3_client, bucket_name, file_name):
     if status_code == 200:
         return True
     return False
+
+
+def _put_acl(aws_s3_client, bucket_name, file_name, acl, limiter=None):
+    # paced by the shared scheduler, a limiter caps it at a fixed rate on top; its wait
+    # comes first, inside the call it would hold a slot and count as latency
+    if limiter:
+        limiter.wait()
+    return SCHEDULER.call(rate_key(bucket_name, file_name), aws_s3_client.put_object_acl,
+                          ACL=acl, Bucket=bucket_name, Key=file_name)
+
+
+def set_objects_access_policy(aws_s3_client, bucket_name, file_names, acl="public-read", limit=DEFAULT_LIMIT) -> dict:
+    # {"succeeded": n, "failed": n}, every key gets its own put_object_acl
+    return run_bounded(lambda file_name: _put_acl(aws_s3_client, bucket_name, file_name, acl), file_names, limit)
+
+
+def set_prefix_access_policy(aws_s3_client, bucket_name, prefix="", acl="public-read", dry_run=False,
+                             limit=DEFAULT_LIMIT, rate=None) -> dict:
+    # keys are streamed from the listing; the shared scheduler finds the pace S3
+    # sustains, `rate` only caps it at put_object_acl per second
+    keys = (each["Key"] for each in iter_keys(aws_s3_client, bucket_name, prefix))
+    if dry_run:
+        count = 0
+        for key in keys:
+            print(f"({acl}) {key}")
+            count += 1
+        print(f"{count} objects would get '{acl}'")
+        return {"succeeded": 0, "failed": 0, "planned": count}
+
+    failures = []
+
+    def failed(key, result, error):
+        if error:
+            failures.append(key)
+            print(f"failed: {key}, {error}")
+
+    limiter = RateLimiter(rate) if rate else None
+    summary = run_bounded(lambda key: _put_acl(aws_s3_client, bucket_name, key, acl, limiter), keys, limit, failed)
+    print("'{0}' set on {1} objects, {2} failed".format(acl, summary["succeeded"], summary["failed"]))
+    summary["failures"] = failures
+    return summary
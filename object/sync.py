@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import md5
+from os import walk, stat, utime, remove
+from pathlib import Path
+from aio import SCHEDULER, rate_key
+from bucket.listing import iter_keys
+from object.content_type import allowed_type, sniff_file
+from object.batch import batches, delete_batch, MAX_DELETE_KEYS
+from object.multipart import DEFAULT_CONCURRENCY
+
+
+def local_files(local_dir) -> dict:
+    # {"relative/posix/path": (path, size, mtime)}
+    files = {}
+    for root, _, names in walk(local_dir):
+        for name in names:
+            path = Path(root, name)
+            file_stat = stat(path)
+            files[path.relative_to(local_dir).as_posix()] = (path, file_stat.st_size, file_stat.st_mtime)
+    return files
+
+
+def remote_files(aws_s3_client, bucket_name, prefix="") -> dict:
+    # {"key without prefix": (key, size, last_modified, etag)}
+    files = {}
+    for each in iter_keys(aws_s3_client, bucket_name, prefix):
+        if each["Key"].endswith("/"):
+            continue
+        files[each["Key"][len(prefix):]] = (
+            each["Key"], each["Size"], each["LastModified"].timestamp(), each["ETag"].strip('"'))
+    return files
+
+
+def file_md5(path) -> str:
+    digest = md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_content(local, remote, direction) -> bool:
+    path, size, mtime = local
+    _, remote_size, remote_mtime, etag = remote
+    if size != remote_size:
+        return False
+    # the destination being newer than the source means it was synced before
+    if (direction == "upload" and mtime <= remote_mtime) or (direction == "download" and remote_mtime <= mtime):
+        return True
+    # multipart ETags are not an MD5 of the content, size and mtime decide
+    if "-" in etag:
+        return False
+    return file_md5(path) == etag
+
+
+def plan_sync(local, remote, direction="upload", delete=False) -> dict:
+    source, destination = (local, remote) if direction == "upload" else (remote, local)
+    plan = {"transfer": [], "delete": []}
+    for name in sorted(source):
+        if name not in destination or not same_content(local[name], remote[name], direction):
+            plan["transfer"].append(name)
+    if delete:
+        plan["delete"] = sorted(set(destination) - set(source))
+    return plan
+
+
+def _upload(aws_s3_client, bucket_name, path, key):
+    aws_s3_client.upload_file(
+        str(path),
+        bucket_name,
+        key,
+        ExtraArgs={'ContentType': allowed_type(sniff_file(path))[0]}
+    )
+
+
+def _download(aws_s3_client, bucket_name, key, path, last_modified):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    aws_s3_client.download_file(bucket_name, key, str(path))
+    # keep the object's time so the next sync sees the file as up to date
+    utime(path, (last_modified, last_modified))
+
+
+def sync(aws_s3_client, bucket_name, local_dir="static", prefix="", direction="upload", delete=False,
+         dry_run=False, concurrency=DEFAULT_CONCURRENCY) -> dict:
+    local_dir = Path(local_dir)
+    local = local_files(local_dir) if local_dir.exists() else {}
+    remote = remote_files(aws_s3_client, bucket_name, prefix)
+    plan = plan_sync(local, remote, direction, delete)
+
+    if dry_run:
+        for name in plan["transfer"]:
+            print(f"({direction}) {name}")
+        for name in plan["delete"]:
+            print(f"(delete) {name}")
+        return plan
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {}
+        for name in plan["transfer"]:
+            # paced by the shared scheduler, `concurrency` is the most it may reach
+            if direction == "upload":
+                future = executor.submit(SCHEDULER.transfer, rate_key(bucket_name, prefix + name), _upload,
+                                         aws_s3_client, bucket_name, local[name][0], prefix + name)
+            else:
+                future = executor.submit(SCHEDULER.transfer, rate_key(bucket_name, remote[name][0]), _download,
+                                         aws_s3_client, bucket_name, remote[name][0], local_dir / name,
+                                         remote[name][2])
+            futures[future] = name
+
+        for future in as_completed(futures):
+            if future.exception():
+                failed.append(futures[future])
+                print(f"{direction} failed: {futures[future]}, {future.exception()}")
+            else:
+                print(f"{direction}: {futures[future]}")
+
+    if direction == "upload":
+        objects = [{"Key": prefix + name} for name in plan["delete"]]
+        for batch in batches(objects, MAX_DELETE_KEYS):
+            for error in delete_batch(aws_s3_client, bucket_name, batch):
+                failed.append(error["Key"][len(prefix):])
+                print(f"delete failed: {error['Key']}, {error['Message']}")
+    else:
+        for name in plan["delete"]:
+            remove(local[name][0])
+
+    plan["failed"] = failed
+    print("{0} to transfer, {1} to delete, {2} failed".format(
+        len(plan["transfer"]), len(plan["delete"]), len(failed)))
+    return plan
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, BoundedSemaphore
+from hashlib import md5
+from bucket.listing import iter_keys
+from object.batch import delete_batch, MAX_DELETE_KEYS
+from object.multipart import DEFAULT_CONCURRENCY, copy_large_object, server_side_copy
+
+
+READ_CHUNK = 1024 * 1024
+
+
+def parse_location(location) -> tuple:
+    # "bucket", "bucket/prefix/" or "s3://bucket/prefix/" -> (bucket, prefix)
+    bucket_name, _, prefix = location.removeprefix("s3://").partition("/")
+    return bucket_name, prefix
+
+
+def destination_key(key, source_prefix, destination_prefix) -> str:
+    return destination_prefix + key[len(source_prefix):]
+
+
+def _stream_md5(aws_s3_client, bucket_name, key) -> str:
+    digest = md5()
+    body = aws_s3_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+    for chunk in body.iter_chunks(READ_CHUNK):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_copy(source_client, source_bucket, source_key, aws_s3_client, bucket_name, key) -> bool:
+    # same size and ETag is enough; SSE-KMS and re-chunked copies have ETags that
+    # aren't comparable, those are read back and hashed on both sides
+    source = source_client.head_object(Bucket=source_bucket, Key=source_key)
+    destination = aws_s3_client.head_object(Bucket=bucket_name, Key=key)
+    if source["ContentLength"] != destination["ContentLength"]:
+        return False
+    if source["ETag"] == destination["ETag"]:
+        return True
+    return _stream_md5(source_client, source_bucket, source_key) == _stream_md5(aws_s3_client, bucket_name, key)
+
+
+def _check_locations(source_bucket, source_prefix, bucket_name, prefix):
+    # the listing is streamed while copying, copies under the source prefix would be listed again
+    if source_bucket == bucket_name and prefix.startswith(source_prefix):
+        raise ValueError(f"Destination '{bucket_name}/{prefix}' is inside the source '{source_bucket}/{source_prefix}'")
+
+
+def copy_prefix(aws_s3_client, source_bucket, source_prefix, bucket_name, prefix, move=False, verify=False,
+                dry_run=False, concurrency=DEFAULT_CONCURRENCY, source_client=None) -> dict:
+    # server-side copy of every key under source_prefix to prefix, the key's rest is kept.
+    # aws_s3_client sends the copies and should be in the destination's region,
+    # source_client lists (and deletes, for a move) in the source's region
+    _check_locations(source_bucket, source_prefix, bucket_name, prefix)
+    source_client = source_client or aws_s3_client
+    report = {"copied": 0, "bytes": 0, "moved": 0, "failed": 0}
+    lock = Lock()
+    slots = BoundedSemaphore(max(1, concurrency))
+    copied = []
+
+    def count(name, amount=1):
+        with lock:
+            report[name] += amount
+
+    def copy(each, key):
+        copy_source = {"Bucket": source_bucket, "Key": each["Key"]}
+        try:
+            if verify and "-" in each["ETag"]:
+                # with the source's part layout the copy gets the same ETag, see copy_large_object
+                copy_large_object(aws_s3_client, copy_source, bucket_name, key, each["Size"], concurrency)
+            else:
+                # copy_object keeps the metadata and content type, bigger objects go part by part
+                server_side_copy(aws_s3_client, copy_source, bucket_name, key, each["Size"], concurrency)
+            if verify and not verify_copy(source_client, source_bucket, each["Key"], aws_s3_client, bucket_name, key):
+                raise ValueError(f"{bucket_name}/{key} doesn't match the source")
+            count("copied")
+            count("bytes", each["Size"])
+            if move:
+                with lock:
+                    copied.append({"Key": each["Key"]})
+        except Exception as error:
+            # a failed copy keeps its source
+            print(f"copy failed: {each['Key']}, {error}")
+            count("failed")
+        finally:
+            slots.release()
+
+    def delete(batch):
+        try:
+            errors = delete_batch(source_client, source_bucket, batch)
+        except Exception as error:
+            print(f"delete failed: {error}")
+            errors = batch
+        finally:
+            slots.release()
+        for error in errors:
+            print(f"delete failed: {error['Key']}")
+        count("failed", len(errors))
+        count("moved", len(batch) - len(errors))
+
+    def take_copied(size):
+        with lock:
+            if len(copied) < size:
+                return []
+            batch = copied[:MAX_DELETE_KEYS]
+            del copied[:MAX_DELETE_KEYS]
+            return batch
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for each in iter_keys(source_client, source_bucket, source_prefix, concurrency=concurrency):
+            key = destination_key(each["Key"], source_prefix, prefix)
+            if dry_run:
+                print(f"{source_bucket}/{each['Key']} -> {bucket_name}/{key}")
+                report["copied"] += 1
+                report["bytes"] += each["Size"]
+                continue
+            slots.acquire()
+            executor.submit(copy, each, key)
+            # sources go in full DeleteObjects batches while the copies go on
+            if batch := take_copied(MAX_DELETE_KEYS):
+                slots.acquire()
+                executor.submit(delete, batch)
+
+    # the copies are done, the rest of the sources
+    while batch := take_copied(1):
+        slots.acquire()
+        delete(batch)
+
+    print("{0} objects ({1} bytes) {2}, {3} failed".format(
+        report["moved"] if move and not dry_run else report["copied"], report["bytes"],
+        "to copy" if dry_run else "moved" if move else "copied", report["failed"]))
+    return report
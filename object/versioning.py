@@ -1,14 +1,24 @@
 
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import Lock, BoundedSemaphore
 from dateutil.relativedelta import relativedelta
+from itertools import groupby
+from bucket.index import indexed_entries
+from bucket.listing import iter_keys
+from object.batch import batches, delete_batch, MAX_DELETE_KEYS
+from object.multipart import DEFAULT_CONCURRENCY, server_side_copy
 
-def list_object_versions(aws_s3_client, bucket_name, file_name):
-    versions = aws_s3_client.list_object_versions(
-        Bucket=bucket_name,
-        Prefix=file_name
-    )
 
-    for version in versions['Versions']:
+def list_object_versions(aws_s3_client, bucket_name, file_name, use_index=False):
+    if use_index:
+        versions = indexed_entries(aws_s3_client, bucket_name, file_name, True)
+    else:
+        versions = iter_keys(aws_s3_client, bucket_name, file_name, versions=True)
+
+    for version in versions:
+        if version.get('IsDeleteMarker'):
+            continue
         version_id = version['VersionId']
         file_key = version['Key'],
         is_latest = version['IsLatest']
@@ -24,28 +34,206 @@ def list_object_versions(aws_s3_client, bucket_name, file_name):
         print(version_id, file_key, is_latest, modified_at)
 
 
-def delete_old_files(aws_s3_client, bucket_name, file_name):
-    versions = aws_s3_client.list_object_versions(
-        Bucket=bucket_name,
-        Prefix=file_name
-    )
-    for version in versions['Versions']:
-        if datetime.date(version['LastModified']) < (datetime.date(datetime.now() - relativedelta(months=6))):
-            version_id = version['VersionId']
-            file_key = version['Key'],
+def _newest_first(versions) -> list:
+    # LastModified can tie, the current version still goes first
+    return sorted(versions, key=lambda v: (v["LastModified"], v["IsLatest"]), reverse=True)
+
+
+def iter_versions(aws_s3_client, bucket_name, prefix):
+    # yields (key, [versions and delete markers of the key, newest first]),
+    # the listing comes in key order so a key's versions are adjacent
+    for key, versions in groupby(iter_keys(aws_s3_client, bucket_name, prefix, versions=True),
+                                 key=lambda version: version["Key"]):
+        yield key, _newest_first(versions)
+
+
+def expired_versions(versions, cutoff, keep_newest=None, noncurrent_only=False) -> list:
+    # versions of one key, newest first; every rule has to agree to delete
+    # keep_newest counts data versions, delete markers only go by the other rules
+    expired = []
+    kept = 0
+    for version in versions:
+        if keep_newest is not None and kept < keep_newest and not version.get("IsDeleteMarker"):
+            kept += 1
+            continue
+        if noncurrent_only and version["IsLatest"]:
+            continue
+        if version["LastModified"] >= cutoff:
+            continue
+        expired.append(version)
+    return expired
+
+
+def delete_old_files(aws_s3_client, bucket_name, file_name, older_than_days=None, keep_newest=None,
+                     noncurrent_only=False, dry_run=False, concurrency=DEFAULT_CONCURRENCY) -> dict:
+    age = relativedelta(months=6) if older_than_days is None else timedelta(days=older_than_days)
+    cutoff = datetime.now(timezone.utc) - age
+    report = {"versions": 0, "delete_markers": 0, "bytes": 0, "failed": 0}
+    lock = Lock()
+    # bounds the batches waiting for a worker, the listing can be huge
+    slots = BoundedSemaphore(max(1, concurrency))
+
+    def expired():
+        for key, versions in iter_versions(aws_s3_client, bucket_name, file_name):
+            for version in expired_versions(versions, cutoff, keep_newest, noncurrent_only):
+                if dry_run:
+                    print(version['VersionId'], version['Key'], version['LastModified'])
+                yield version
+
+    def delete(batch):
+        try:
+            errors = delete_batch(aws_s3_client, bucket_name,
+                                  [{"Key": version["Key"], "VersionId": version["VersionId"]} for version in batch])
+        except Exception as error:
+            print(f"delete failed: {error}")
+            errors = [{"Key": version["Key"], "VersionId": version["VersionId"]} for version in batch]
+        finally:
+            slots.release()
+
+        failed = {(error["Key"], error.get("VersionId")) for error in errors}
+        with lock:
+            for version in batch:
+                if (version["Key"], version["VersionId"]) in failed:
+                    report["failed"] += 1
+                elif version.get("IsDeleteMarker"):
+                    report["delete_markers"] += 1
+                else:
+                    report["versions"] += 1
+                    report["bytes"] += version["Size"]
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for batch in batches(expired(), MAX_DELETE_KEYS):
+            if dry_run:
+                report["versions"] += sum(not version.get("IsDeleteMarker") for version in batch)
+                report["delete_markers"] += sum(bool(version.get("IsDeleteMarker")) for version in batch)
+                report["bytes"] += sum(version["Size"] for version in batch)
+                continue
+            slots.acquire()
+            executor.submit(delete, batch)
 
-            response = aws_s3_client.delete_object(
-                Bucket=bucket_name,
-                Key=file_key[0],
-                VersionId=version_id,
-            )
-        
-            print(version_id, file_key)
+    print("{0} versions and {1} delete markers {2}, {3} bytes reclaimed, {4} failed".format(
+        report["versions"], report["delete_markers"], "to delete" if dry_run else "deleted",
+        report["bytes"], report["failed"]))
+    return report
 
 
 def rollback_to_version(aws_s3_client, bucket_name, file_name, version):
-    aws_s3_client.copy_object(
-        Bucket=bucket_name,
-        Key=file_name,
-        CopySource={'Bucket': bucket_name, 'Key': file_name, 'VersionId': version}
+    # copy_object stops at 5 GB, server_side_copy switches to a multipart copy
+    size = aws_s3_client.head_object(Bucket=bucket_name, Key=file_name, VersionId=version)["ContentLength"]
+    server_side_copy(
+        aws_s3_client,
+        {'Bucket': bucket_name, 'Key': file_name, 'VersionId': version},
+        bucket_name,
+        file_name,
+        size
     )
+
+
+def version_at(versions, timestamp):
+    # (position, entry) current at timestamp, a version or a delete marker;
+    # (None, None) when the key didn't exist yet. versions are newest first
+    for position, version in enumerate(versions):
+        if version["LastModified"] <= timestamp:
+            return position, version
+    return None, None
+
+
+def restore_action(versions, timestamp, delete_absent=False):
+    # ("copy", [version]), ("unmark", [delete markers]), ("delete", [current]) or None
+    current = versions[0]
+    position, target = version_at(versions, timestamp)
+    if target is None or target.get("IsDeleteMarker"):
+        # absent at timestamp, only removed when asked to
+        if delete_absent and not current.get("IsDeleteMarker"):
+            return "delete", [current]
+        return None
+    if target["VersionId"] == current["VersionId"]:
+        return None
+    # already restored by an earlier run, the copy is newer but holds the same bytes
+    if not current.get("IsDeleteMarker") and \
+            (current.get("ETag"), current["Size"]) == (target.get("ETag"), target["Size"]):
+        return None
+    newer = versions[:position]
+    # deleted since: dropping the markers makes the version current again, nothing is copied
+    if all(version.get("IsDeleteMarker") for version in newer):
+        return "unmark", newer
+    return "copy", [target]
+
+
+def restore_to_time(aws_s3_client, bucket_name, prefix, timestamp, delete_absent=False, dry_run=False,
+                    concurrency=DEFAULT_CONCURRENCY) -> dict:
+    # every key under the prefix goes back to its version current at timestamp
+    report = {"copied": 0, "unmarked": 0, "deleted": 0, "unchanged": 0, "failed": 0}
+    lock = Lock()
+    slots = BoundedSemaphore(max(1, concurrency))
+
+    def count(name, amount=1):
+        with lock:
+            report[name] += amount
+
+    def copy(version):
+        try:
+            server_side_copy(aws_s3_client, {"Bucket": bucket_name, "Key": version["Key"],
+                                             "VersionId": version["VersionId"]},
+                             bucket_name, version["Key"], version["Size"])
+            count("copied")
+        except Exception as error:
+            print(f"restore failed: {version['Key']}, {error}")
+            count("failed")
+        finally:
+            slots.release()
+
+    def delete(batch):
+        # marker removals and new delete markers, one DeleteObjects call per 1000
+        try:
+            errors = delete_batch(aws_s3_client, bucket_name, [each for each, _ in batch])
+        except Exception as error:
+            print(f"delete failed: {error}")
+            errors = [each for each, _ in batch]
+        finally:
+            slots.release()
+
+        failed = {(error["Key"], error.get("VersionId")) for error in errors}
+        for each, name in batch:
+            if (each["Key"], each.get("VersionId")) in failed:
+                count("failed")
+            elif name:
+                count(name)
+
+    def actions():
+        for key, versions in iter_versions(aws_s3_client, bucket_name, prefix):
+            action = restore_action(versions, timestamp, delete_absent)
+            if action is None:
+                count("unchanged")
+                continue
+            if dry_run:
+                print(f"{action[0]}: {key} ({', '.join(entry['VersionId'] for entry in action[1])})")
+            yield key, action
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for key, (name, entries) in actions():
+            if dry_run:
+                report[{"copy": "copied", "unmark": "unmarked", "delete": "deleted"}[name]] += 1
+                continue
+            if name == "copy":
+                slots.acquire()
+                executor.submit(copy, entries[0])
+                continue
+            # a delete marker goes away by its VersionId, a plain Key adds one;
+            # a key with several markers is counted once
+            pending += [({"Key": key, "VersionId": entry["VersionId"]}, None if position else "unmarked")
+                        for position, entry in enumerate(entries)] \
+                if name == "unmark" else [({"Key": key}, "deleted")]
+            if len(pending) >= MAX_DELETE_KEYS:
+                slots.acquire()
+                executor.submit(delete, pending[:MAX_DELETE_KEYS])
+                pending = pending[MAX_DELETE_KEYS:]
+        if pending:
+            slots.acquire()
+            executor.submit(delete, pending)
+
+    print("{0} copied, {1} undeleted, {2} deleted, {3} unchanged, {4} failed{5}".format(
+        report["copied"], report["unmarked"], report["deleted"], report["unchanged"], report["failed"],
+        " (dry run)" if dry_run else ""))
+    return report
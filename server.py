@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+from botocore.exceptions import ClientError
+from flask import Flask, Response, jsonify, request
+from metrics import METRICS
+import io
+import json
+import sys
+import threading
+
+
+class ThreadOutput(io.TextIOBase):
+    # writes from a request thread go to that request's buffer,
+    # everything else to the real stream
+    local = threading.local()
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        return (getattr(self.local, "buffer", None) or self.stream).write(text)
+
+    def flush(self):
+        (getattr(self.local, "buffer", None) or self.stream).flush()
+
+
+def install_thread_output():
+    # once per process, before worker threads start printing
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout, sys.stderr = ThreadOutput(sys.stdout), ThreadOutput(sys.stderr)
+
+
+@contextmanager
+def capture_output():
+    # stdout and stderr (argparse errors) of the current thread
+    ThreadOutput.local.buffer = io.StringIO()
+    try:
+        yield ThreadOutput.local.buffer
+    finally:
+        ThreadOutput.local.buffer = None
+
+
+def create_app(s3_client):
+    # imported here, main.py imports this module for `serve` and `--remote`
+    from main import parser, run
+
+    app = Flask(__name__)
+    install_thread_output()
+
+    @app.get("/health")
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.get("/metrics")
+    def metrics():
+        # totals of every command this server ran
+        return Response(METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
+    @app.post("/run")
+    def run_command():
+        argv = request.get_json(force=True).get("argv", [])
+        status, error = 200, None
+        with capture_output() as output:
+            try:
+                args = parser.parse_args(argv)
+                if args.command in (None, "serve"):
+                    raise ValueError(f"Can't run '{args.command}' remotely")
+                run(s3_client, args)
+            except SystemExit as exit:
+                # argparse errors and parser.error() exit, the server must not
+                status, error = (200, None) if exit.code == 0 else (400, "invalid arguments")
+            except ClientError as client_error:
+                status, error = 502, str(client_error)
+            except ValueError as value_error:
+                status, error = 400, str(value_error)
+            except Exception as unexpected:
+                # still JSON, forward() reads the error and the output captured so far
+                status, error = 500, f"{type(unexpected).__name__}: {unexpected}"
+        return jsonify({"output": output.getvalue(), "error": error}), status
+
+    return app
+
+
+def serve(s3_client, host="127.0.0.1", port=8765):
+    # threaded, boto3 clients are safe to share between threads
+    create_app(s3_client).run(host=host, port=port, threaded=True)
+
+
+def forward(url, argv):
+    data = json.dumps({"argv": argv}).encode("utf-8")
+    req = Request(f"{url.rstrip('/')}/run", data=data, headers={"Content-Type": "application/json"})
+    try:
+        try:
+            with urlopen(req) as response:
+                result = json.load(response)
+        except HTTPError as error:
+            result = json.load(error)
+    except URLError as error:
+        raise ValueError(f"Server {url} can't be reached: {error.reason}")
+    except json.JSONDecodeError:
+        raise ValueError(f"Server {url} didn't answer with JSON, is it this app's server?")
+
+    print(result["output"], end="")
+    if result["error"]:
+        raise ValueError(result["error"])
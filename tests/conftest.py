@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    # moto in-process, throwaway credentials so nothing from .env is sent anywhere
+    from moto import mock_aws
+    from auth import init_client
+    for name, value in {"aws_access_key_id": "testing", "aws_secret_access_key": "testing",
+                        "aws_region_name": "us-east-1"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("aws_session_token", raising=False)
+    monkeypatch.delenv("aws_endpoint_url", raising=False)
+    with mock_aws():
+        yield init_client()
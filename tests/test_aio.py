@@ -0,0 +1,27 @@
+from bucket.crud import buckets_exist
+from object.crud import head_objects
+from object.policy import set_objects_access_policy
+
+
+def test_buckets_exist(s3_client):
+    s3_client.create_bucket(Bucket="bkt")
+    assert buckets_exist(s3_client, ["bkt", "missing-bkt"], limit=4) == {"bkt": True, "missing-bkt": False}
+
+
+def test_head_objects(s3_client):
+    s3_client.create_bucket(Bucket="bkt")
+    s3_client.put_object(Bucket="bkt", Key="a/1.txt", Body=b"hello")
+    heads = head_objects(s3_client, "bkt", ["a/1.txt", "a/2.txt"], limit=4)
+    assert heads["a/1.txt"]["ContentLength"] == 5
+    assert heads["a/2.txt"] is None
+
+
+def test_set_objects_access_policy(s3_client):
+    s3_client.create_bucket(Bucket="bkt")
+    keys = [f"a/{number}.txt" for number in range(20)]
+    for key in keys:
+        s3_client.put_object(Bucket="bkt", Key=key, Body=b"hello")
+    assert set_objects_access_policy(s3_client, "bkt", keys + ["a/missing.txt"], limit=4) == \
+        {"succeeded": 20, "failed": 1}
+    grants = s3_client.get_object_acl(Bucket="bkt", Key="a/7.txt")["Grants"]
+    assert any(grant["Grantee"].get("URI", "").endswith("/AllUsers") for grant in grants)
@@ -0,0 +1,14 @@
+from object.crud import download_file_and_upload_to_s3
+
+
+def test_url_upload_with_folders_in_the_key(s3_client, tmp_path, monkeypatch):
+    source = tmp_path / "hello.txt"
+    source.write_text("hello world\n")
+    monkeypatch.chdir(tmp_path)
+    s3_client.create_bucket(Bucket="bkt")
+
+    download_file_and_upload_to_s3(s3_client, "bkt", source.as_uri(), key_template="{hash}/{date}/{id}.{ext}")
+    key = s3_client.list_objects_v2(Bucket="bkt")["Contents"][0]["Key"]
+    assert key.count("/") == 4
+    assert (tmp_path / "static" / key).read_text() == "hello world\n"
+    assert s3_client.list_multipart_uploads(Bucket="bkt").get("Uploads", []) == []
@@ -0,0 +1,36 @@
+import os
+import pytest
+from object.download import download_object
+
+MiB = 1024 * 1024
+
+
+def _multipart(s3_client, key, sizes):
+    upload = s3_client.create_multipart_upload(Bucket="bkt", Key=key)
+    parts, data = [], b""
+    for number, size in enumerate(sizes, start=1):
+        body = os.urandom(size)
+        data += body
+        part = s3_client.upload_part(Bucket="bkt", Key=key, UploadId=upload["UploadId"], PartNumber=number, Body=body)
+        parts.append({"PartNumber": number, "ETag": part["ETag"]})
+    s3_client.complete_multipart_upload(Bucket="bkt", Key=key, UploadId=upload["UploadId"],
+                                        MultipartUpload={"Parts": parts})
+    return data
+
+
+@pytest.mark.parametrize("sizes", [(5 * MiB, 5 * MiB, 100), (5 * MiB, 6 * MiB, 5 * MiB + 1)])
+def test_download_checks_multipart_etags_of_any_part_layout(s3_client, tmp_path, sizes):
+    s3_client.create_bucket(Bucket="bkt")
+    data = _multipart(s3_client, "big.bin", sizes)
+    output = download_object(s3_client, "bkt", "big.bin", tmp_path / "big.bin", concurrency=4)
+    assert output.read_bytes() == data
+
+
+def test_checksum_mismatch_keeps_the_download(s3_client, tmp_path, monkeypatch):
+    s3_client.create_bucket(Bucket="bkt")
+    s3_client.put_object(Bucket="bkt", Key="small.bin", Body=b"payload")
+    monkeypatch.setattr("object.download.expected_etag", lambda *args: "0" * 32)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        download_object(s3_client, "bkt", "small.bin", tmp_path / "small.bin")
+    assert (tmp_path / "small.bin.part").read_bytes() == b"payload"
+    assert not (tmp_path / "small.bin.download.json").exists()
@@ -0,0 +1,36 @@
+from bucket.index import connect, indexed_pages, refresh_index
+
+
+def _keys(connection, bucket_name):
+    return [entry["Key"] for page in indexed_pages(bucket_name, connection=connection) for entry in page["Contents"]]
+
+
+def test_refresh_removes_a_vanished_prefix(s3_client, tmp_path):
+    connection = connect(tmp_path / "index.sqlite3")
+    s3_client.create_bucket(Bucket="bkt")
+    for key in ("a/1", "a/2", "z/1"):
+        s3_client.put_object(Bucket="bkt", Key=key, Body=b"x")
+    refresh_index(s3_client, "bkt", connection=connection)
+    assert _keys(connection, "bkt") == ["a/1", "a/2", "z/1"]
+
+    s3_client.delete_object(Bucket="bkt", Key="z/1")
+    report = refresh_index(s3_client, "bkt", connection=connection)
+    assert report == {"changed": 0, "removed": 1}
+    assert _keys(connection, "bkt") == ["a/1", "a/2"]
+
+
+def test_refresh_of_an_emptied_prefix_keeps_the_rest(s3_client, tmp_path):
+    connection = connect(tmp_path / "index.sqlite3")
+    s3_client.create_bucket(Bucket="bkt")
+    for key in ("a/1", "b/1", "b/2", "top"):
+        s3_client.put_object(Bucket="bkt", Key=key, Body=b"x")
+    refresh_index(s3_client, "bkt", connection=connection)
+
+    for key in ("b/1", "b/2"):
+        s3_client.delete_object(Bucket="bkt", Key=key)
+    s3_client.put_object(Bucket="bkt", Key="a/1", Body=b"changed")
+    report = refresh_index(s3_client, "bkt", "b/", connection=connection)
+    assert report == {"changed": 0, "removed": 2}
+    # a/1 is outside the refreshed prefix, its stale row stays until a refresh covers it
+    assert _keys(connection, "bkt") == ["a/1", "top"]
+    assert refresh_index(s3_client, "bkt", connection=connection) == {"changed": 1, "removed": 0}
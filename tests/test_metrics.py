@@ -0,0 +1,21 @@
+import io
+from metrics import Progress
+
+
+def test_progress_without_total_ends_its_line_on_close():
+    stream = io.StringIO()
+    progress = Progress(label="up.bin", stream=stream)
+    progress.update(1024 * 1024)
+    progress.close()
+    progress.close()
+    assert stream.getvalue().endswith("\n")
+    assert stream.getvalue().count("\n") == 1
+    assert "1.0 MiB" in stream.getvalue().splitlines()[-1]
+
+
+def test_finished_progress_is_not_closed_twice():
+    stream = io.StringIO()
+    progress = Progress(10, "up.bin", stream=stream)
+    progress.update(10)
+    progress.close()
+    assert stream.getvalue().count("\n") == 1
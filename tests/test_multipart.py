@@ -0,0 +1,15 @@
+import io
+from object.multipart import GROW_EVERY_PARTS, MAX_PARTS, MIN_PART_BYTES, growing_part_size, read_parts
+
+
+def test_growing_parts_cover_the_largest_object():
+    # https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+    assert sum(growing_part_size(n, MIN_PART_BYTES) for n in range(1, MAX_PARTS + 1)) >= 5 * 1024 ** 4
+
+
+def test_read_parts_grows_after_every_step():
+    data = b"x" * (GROW_EVERY_PARTS * 3 + 5)
+    sizes = [len(part) for part in read_parts(io.BytesIO(data), 1, grow=True)]
+    assert sizes[:GROW_EVERY_PARTS] == [1] * GROW_EVERY_PARTS
+    assert sizes[GROW_EVERY_PARTS] == 2
+    assert sum(sizes) == len(data)
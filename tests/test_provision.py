@@ -0,0 +1,27 @@
+from bucket.provision import diff_state
+
+
+POLICY = {
+    "Version": "2012-10-17",
+    "Statement": [{"Effect": "Allow", "Principal": "*", "Action": ["s3:GetObject"],
+                   "Resource": ["arn:aws:s3:::{bucket}/*"]}]
+}
+
+
+def test_default_encryption_is_no_encryption():
+    current = {"exists": True, "versioning": False, "encryption": {"SSEAlgorithm": "AES256"}, "policy": None}
+    assert diff_state("bkt", {"encryption": None}, current) == []
+    current["encryption"] = {"SSEAlgorithm": "aws:kms", "KMSMasterKeyID": "key"}
+    assert [change["setting"] for change in diff_state("bkt", {"encryption": None}, current)] == ["encryption"]
+
+
+def test_policy_in_the_shape_s3_returns_has_no_drift():
+    stored = {
+        "Version": "2012-10-17",
+        "Statement": [{"Effect": "Allow", "Principal": {"AWS": "*"}, "Action": "s3:GetObject",
+                       "Resource": "arn:aws:s3:::bkt/*"}]
+    }
+    current = {"exists": True, "versioning": False, "encryption": None, "policy": stored}
+    assert diff_state("bkt", {"policy": POLICY}, current) == []
+    stored["Statement"][0]["Action"] = "s3:PutObject"
+    assert [change["setting"] for change in diff_state("bkt", {"policy": POLICY}, current)] == ["policy"]
@@ -0,0 +1,166 @@
+import pytest
+from botocore.exceptions import ClientError
+import aio
+import object.batch
+from aio import AdaptiveScheduler
+from object.batch import delete_batch
+
+
+class Clock:
+    # monotonic and sleep of aio, sleeping moves the time on
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(aio, "monotonic", clock.monotonic)
+    monkeypatch.setattr(aio, "sleep", clock.sleep)
+    return clock
+
+
+def slow_down():
+    return ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}}, "PutObject")
+
+
+def test_window_grows_until_throttled_then_halves_once(clock):
+    scheduler = AdaptiveScheduler(maximum=100, start=2)
+    for _ in range(10):
+        scheduler.call("bkt/", lambda: None)
+    assert scheduler.limit == 12
+
+    calls = []
+
+    def throttled_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise slow_down()
+
+    scheduler.call("bkt/", throttled_once)
+    assert len(calls) == 2
+    assert scheduler.limit == 6 + 1 / 6
+    # the calls still in flight at the old window report it too, the window isn't cut again
+    scheduler.throttled("bkt/")
+    assert scheduler.limit == 6 + 1 / 6
+    assert not scheduler.slow_start
+
+
+def test_failed_calls_do_not_grow_the_window(clock):
+    scheduler = AdaptiveScheduler(maximum=100, start=2)
+    scheduler.throttled("bkt/")
+    limit, pace = scheduler.limit, scheduler.prefixes["bkt/"].limit
+
+    def access_denied():
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+
+    with pytest.raises(ClientError):
+        scheduler.call("bkt/", access_denied)
+    assert (scheduler.limit, scheduler.prefixes["bkt/"].limit) == (limit, pace)
+    assert scheduler.in_flight == 0
+
+
+def test_throttled_prefix_is_paced_without_holding_a_slot(clock, monkeypatch):
+    scheduler = AdaptiveScheduler(maximum=1, start=1)
+    scheduler.throttled("bkt/hot/")
+    pace = 1 / scheduler.prefixes["bkt/hot/"].limit
+    in_flight = []
+    monkeypatch.setattr(aio, "sleep", lambda seconds: (in_flight.append(scheduler.in_flight), clock.sleep(seconds)))
+
+    scheduler.acquire("bkt/hot/")
+    scheduler.release("bkt/hot/", "put", 0.1, False)
+    scheduler.acquire("bkt/hot/")
+    assert clock.slept == [pytest.approx(pace)]
+    assert in_flight == [0]
+    scheduler.release("bkt/hot/", "put", 0.1, False)
+
+    # other prefixes aren't paced
+    scheduler.acquire("bkt/cold/")
+    assert len(clock.slept) == 1
+
+
+def test_transfer_is_sent_once_and_its_latency_is_not_learnt(clock):
+    scheduler = AdaptiveScheduler()
+    calls = []
+
+    def upload_file():
+        calls.append(1)
+        raise slow_down()
+
+    with pytest.raises(ClientError):
+        scheduler.transfer("bkt/", upload_file)
+    assert len(calls) == 1
+    assert scheduler.throttles == 1
+
+    scheduler.transfer("bkt/", lambda: clock.sleep(30))
+    assert scheduler.latency == {}
+    assert scheduler.in_flight == 0
+
+
+class DeleteObjects:
+    # answers with SlowDown for `busy` keys once and AccessDenied for `denied` ones
+    def __init__(self, busy, denied):
+        self.busy = set(busy)
+        self.denied = set(denied)
+        self.sent = []
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [each["Key"] for each in Delete["Objects"]]
+        self.sent.append(keys)
+        errors = [{"Key": key, "Code": "AccessDenied"} for key in keys if key in self.denied]
+        if len(self.sent) == 1:
+            errors += [{"Key": key, "Code": "SlowDown"} for key in keys if key in self.busy]
+        return {"Errors": errors}
+
+
+def test_delete_batch_resends_only_busy_keys(clock, monkeypatch):
+    scheduler = AdaptiveScheduler()
+    monkeypatch.setattr(object.batch, "SCHEDULER", scheduler)
+    client = DeleteObjects(busy=["b/1", "b/2"], denied=["a/2"])
+
+    failed = delete_batch(client, "bkt", [{"Key": key} for key in ["a/1", "a/2", "b/1", "b/2", "c/1"]])
+    assert client.sent[1:] == [["b/1", "b/2"]]
+    assert [error["Key"] for error in failed] == ["a/2"]
+    # the throttle is the busy keys' prefix, not the one the batch starts with
+    assert scheduler.prefixes["bkt/b/"].throttles == 1
+    assert scheduler.prefixes["bkt/a/"].throttles == 0
+
+
+class Response:
+    # what before-send may answer instead of sending the request
+    def __init__(self, status):
+        self.status_code = status
+        self.headers = {}
+        self.content = b""
+        self.raw = self
+
+    def stream(self):
+        return iter([b""])
+
+
+def test_throttles_retried_by_botocore_reach_the_scheduler(clock, monkeypatch):
+    from auth import init_client
+    scheduler = AdaptiveScheduler(maximum=100, start=20)
+    monkeypatch.setattr("auth.watch_throttles", lambda client: aio.watch_throttles(client, scheduler))
+    # botocore's own backoff between the attempts
+    monkeypatch.setattr("botocore.endpoint.time.sleep", lambda seconds: None)
+    for name, value in {"aws_access_key_id": "testing", "aws_secret_access_key": "testing",
+                        "aws_region_name": "us-east-1"}.items():
+        monkeypatch.setenv(name, value)
+    client = init_client("http://s3.test", retry_mode="standard", max_attempts=5)
+    answers = [Response(503), Response(503), Response(200)]
+    client.meta.events.register("before-send.s3", lambda **kwargs: answers.pop(0))
+
+    response = scheduler.call(aio.rate_key("bkt", "a/1.txt"), client.head_object, Bucket="bkt", Key="a/1.txt")
+    assert response["ResponseMetadata"]["RetryAttempts"] == 2
+    assert scheduler.throttles == 2
+    assert scheduler.prefixes["bkt/a/"].limit is not None
+    assert scheduler.limit < 20
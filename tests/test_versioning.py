@@ -0,0 +1,14 @@
+from datetime import datetime, timedelta, timezone
+from object.versioning import expired_versions
+
+
+def test_keep_newest_counts_data_versions_only():
+    now = datetime.now(timezone.utc)
+    versions = [
+        {"VersionId": "marker2", "IsDeleteMarker": True, "IsLatest": True, "LastModified": now - timedelta(days=1)},
+        {"VersionId": "marker1", "IsDeleteMarker": True, "IsLatest": False, "LastModified": now - timedelta(days=2)},
+        {"VersionId": "v2", "IsLatest": False, "LastModified": now - timedelta(days=40)},
+        {"VersionId": "v1", "IsLatest": False, "LastModified": now - timedelta(days=50)},
+    ]
+    expired = expired_versions(versions, now - timedelta(days=30), keep_newest=1)
+    assert [version["VersionId"] for version in expired] == ["v1"]